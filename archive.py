@@ -0,0 +1,128 @@
+"""
+Архивирование талонов: разделение на "горячие" и "холодные" данные.
+
+Таблица tickets хранит только текущий учебный год — её индексы (date и
+uq_ticket_teacher_date) остаются маленькими, и ежедневные вставки и отчёты
+работают быстро. Закрытые учебные годы переносятся в tickets_archive.
+Отчёты обращаются к архиву только тогда, когда запрошенный диапазон дат
+начинается раньше текущего учебного года.
+
+Перенос закрытых лет (запускать, например, раз в год в сентябре):
+    python archive.py                      # всё, что раньше текущего учебного года
+    python archive.py --before 2024-09-01  # всё, что раньше указанной даты
+"""
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import select, insert, delete, union_all
+from sqlalchemy.sql import Subquery
+from sqlalchemy.orm import Session
+
+from models import Ticket, ArchivedTicket, ChangeLog, ChangeEntity
+
+# Учебный год начинается 1 сентября
+SCHOOL_YEAR_START_MONTH = 9
+SCHOOL_YEAR_START_DAY = 1
+
+
+def school_year_start(d: date) -> date:
+    """
+    Возвращает дату начала учебного года, в который попадает дата d.
+    """
+    year = d.year if d.month >= SCHOOL_YEAR_START_MONTH else d.year - 1
+    return date(year, SCHOOL_YEAR_START_MONTH, SCHOOL_YEAR_START_DAY)
+
+
+def hot_boundary(today: Optional[date] = None) -> date:
+    """
+    Граница горячих данных: начало текущего учебного года.
+    Всё, что раньше этой даты, может находиться в архиве.
+    """
+    return school_year_start(today or date.today())
+
+
+def tickets_in_range(start: date, end: date, teacher_ids=None):
+    """
+    Возвращает подзапрос с талонами за период [start, end].
+    - Если период целиком в текущем учебном году — читается только tickets.
+    - Иначе к tickets через UNION ALL добавляется tickets_archive.
+    - teacher_ids: список или подзапрос с ID учителей (фильтр применяется
+      внутри каждой ветки, чтобы SQLite использовал индексы обеих таблиц).
+    Колонки подзапроса совпадают с колонками Ticket (доступ через .c).
+    """
+    if isinstance(teacher_ids, Subquery):
+        teacher_ids = select(teacher_ids)
+
+    def branch(model):
+        query = select(
+            model.id, model.date, model.paid_count, model.free_count,
+            model.class_name, model.teacher_id,
+        ).where(model.date.between(start, end))
+        if teacher_ids is not None:
+            query = query.where(model.teacher_id.in_(teacher_ids))
+        return query
+
+    if start >= hot_boundary():
+        return branch(Ticket).subquery("tickets_hot")
+    return union_all(branch(Ticket), branch(ArchivedTicket)).subquery("tickets_all")
+
+
+def archived_ticket_exists(db: Session, teacher_id: int, d: date) -> bool:
+    """
+    Проверяет, есть ли в архиве талон учителя на указанную дату.
+    Нужна при подаче талона задним числом в уже закрытый учебный год.
+    """
+    return db.query(ArchivedTicket.id).filter(
+        ArchivedTicket.teacher_id == teacher_id,
+        ArchivedTicket.date == d
+    ).first() is not None
+
+
+def archive_before(db: Session, before: Optional[date] = None) -> int:
+    """
+    Переносит все талоны с датой раньше before в tickets_archive.
+    - По умолчанию before — начало текущего учебного года.
+    - Переносить можно только закрытые учебные годы.
+    - Копирование и удаление выполняются в одной транзакции.
+    - Записи журнала изменений о перенесённых талонах удаляются
+      (синхронизация клиентов касается только текущего учебного года).
+    Возвращает количество перенесённых талонов.
+    """
+    boundary = hot_boundary()
+    before = before or boundary
+    if before > boundary:
+        raise ValueError(f"Only closed school years can be archived (before <= {boundary})")
+
+    # id не переносим: у архива своя нумерация
+    columns = [c for c in Ticket.__table__.columns if c.name != "id"]
+    moved = db.execute(
+        insert(ArchivedTicket).from_select(
+            [c.name for c in columns],
+            select(*columns).where(Ticket.date < before)
+        )
+    ).rowcount
+    db.execute(delete(ChangeLog).where(
+        ChangeLog.entity == ChangeEntity.ticket,
+        ChangeLog.entity_id.in_(select(Ticket.id).where(Ticket.date < before))
+    ))
+    db.execute(delete(Ticket).where(Ticket.date < before))
+    db.commit()
+    return moved
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database import Base, SessionLocal, shard_engines
+
+    parser = argparse.ArgumentParser(description="Перенос талонов закрытых учебных лет в архив")
+    parser.add_argument("--before", type=date.fromisoformat, default=None,
+                        help="перенести талоны с датой раньше указанной (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    # Архивируем каждый шард БД (без шардирования он один)
+    for number, shard_engine in enumerate(shard_engines):
+        Base.metadata.create_all(bind=shard_engine)
+        with SessionLocal(bind=shard_engine) as session:
+            count = archive_before(session, args.before)
+        print(f"shard {number}: archived {count} tickets")
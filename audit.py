@@ -0,0 +1,284 @@
+"""
+Журнал аудита: кто и когда подал талоны или изменил профиль.
+
+Запись идёт в обход пути запроса (write-behind): эндпоинт только кладёт
+событие в ограниченную очередь в памяти (put_nowait, без ожидания), а
+фоновый поток пачками дописывает события в файлы журнала. Поэтому аудит
+не добавляет задержки подаче талонов в утренний пик. Если очередь
+переполнена (диск не успевает), событие отбрасывается и учитывается в
+счётчике dropped, а запрос не тормозится.
+
+Формат: папка AUDIT_DIR с сегментами audit-000001.log, audit-000002.log, ...
+Каждая строка — одно событие в JSON. Файлы только дописываются; событие,
+которое не помещается в AUDIT_SEGMENT_MB, начинает следующий сегмент.
+
+AUDIT_FSYNC — когда данные сбрасываются на диск (os.fsync):
+- always   — после каждой пачки (при сбое теряется только незаписанная очередь);
+- interval — раз в секунду, если с прошлого сброса что-то записано (по умолчанию):
+  поток записи просыпается для этого сам, даже если новых событий нет;
+- never    — сброс на диск оставляется операционной системе.
+
+Включается переменной окружения AUDIT_DIR. Просмотр журнала:
+    python audit.py query --action ticket.submit --teacher 12 --since 2026-10-01
+"""
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional
+
+from environ_init import AUDIT_DIR, AUDIT_SEGMENT_MB, AUDIT_FSYNC, AUDIT_QUEUE_SIZE
+
+FSYNC_POLICIES = ("always", "interval", "never")
+FSYNC_INTERVAL = 1.0          # период fsync для политики interval, секунд
+SEGMENT_PREFIX = "audit-"
+SEGMENT_SUFFIX = ".log"
+
+
+def segment_paths(directory: str) -> List[str]:
+    """Сегменты журнала в порядке записи."""
+    if not os.path.isdir(directory):
+        return []
+    names = [
+        name for name in os.listdir(directory)
+        if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+    ]
+    return [os.path.join(directory, name) for name in sorted(names)]
+
+
+class AuditLog:
+    """
+    Очередь событий аудита и фоновый поток, дописывающий их в сегменты.
+    - directory: папка сегментов
+    - segment_bytes: размер сегмента, после которого начинается следующий
+    - fsync: политика сброса на диск (always / interval / never)
+    - queue_size: ёмкость очереди; при переполнении события отбрасываются
+    - max_batch: максимальный размер пачки
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 16 * 1024 * 1024, fsync: str = "interval",
+                 queue_size: int = 10000, max_batch: int = 512):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy {fsync!r}, expected one of {FSYNC_POLICIES}")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.max_batch = max_batch
+        self.dropped = 0               # события, не попавшие в очередь (переполнение)
+        self.failed = 0                # события, которые не удалось записать (ошибка диска)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._file = None
+        self._number = 0
+        self._last_fsync = time.monotonic()
+        self._dirty = False            # есть записанные, но не сброшенные на диск данные
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def record(self, action: str, actor_id: int, **fields) -> bool:
+        """
+        Ставит событие в очередь, не дожидаясь записи.
+        Время события — момент вызова. Возвращает False, если очередь переполнена.
+        """
+        event = {
+            "ts": datetime.now(timezone.utc).isoformat(timespec="microseconds"),
+            "action": action,
+            "actor_id": actor_id,
+            **fields,
+        }
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def flush(self) -> None:
+        """Ждёт, пока все поставленные в очередь события будут записаны."""
+        self._queue.join()
+
+    def close(self) -> None:
+        """Дописывает очередь, сбрасывает файл на диск и останавливает поток."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self) -> None:
+        """
+        Фоновый цикл: забирает всё, что накопилось в очереди (до max_batch), и дописывает пачкой.
+        При политике interval ждёт очередь не дольше, чем до следующего fsync.
+        """
+        while True:
+            timeout = None
+            if self._dirty and self.fsync == "interval":
+                timeout = max(self._last_fsync + FSYNC_INTERVAL - time.monotonic(), 0)
+            try:
+                batch = [self._queue.get(timeout=timeout)]
+            except queue.Empty:
+                try:
+                    self._sync()
+                except OSError:
+                    pass   # повторим через FSYNC_INTERVAL
+                continue
+            while len(batch) < self.max_batch and batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            events = [event for event in batch if event is not None]
+            try:
+                if events:
+                    self._write(events)
+                if stop and self._file:
+                    self._sync()
+                    self._file.close()
+            except OSError:
+                with self._lock:
+                    self.failed += len(events)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _write(self, events) -> None:
+        """
+        Дописывает пачку. Как только очередная строка не помещается в сегмент,
+        начинается следующий (в том числе сразу после перезапуска, если последний
+        сегмент уже заполнен). Больше лимита сегмент бывает, только если одно
+        событие само длиннее AUDIT_SEGMENT_MB.
+        """
+        if self._file is None:
+            self._open_last()
+        size = self._file.tell()
+        chunk = []
+        for event in events:
+            line = (json.dumps(event, ensure_ascii=False, default=str) + "\n").encode()
+            if size and size + len(line) > self.segment_bytes:
+                self._file.write(b"".join(chunk))
+                chunk = []
+                self._rotate()
+                size = 0
+            chunk.append(line)
+            size += len(line)
+        self._file.write(b"".join(chunk))
+        self._file.flush()
+        self._dirty = True
+
+        if self.fsync == "always" or (
+            self.fsync == "interval" and time.monotonic() - self._last_fsync >= FSYNC_INTERVAL
+        ):
+            self._sync()
+
+    def _sync(self) -> None:
+        self._last_fsync = time.monotonic()
+        if self.fsync != "never":
+            os.fsync(self._file.fileno())
+        self._dirty = False
+
+    def _open_last(self) -> None:
+        """
+        После перезапуска продолжает последний сегмент (или создаёт первый).
+        Если сегмент оборвался на середине строки (сбой во время записи),
+        начинается новый — иначе первое событие склеилось бы с обрывком.
+        """
+        paths = segment_paths(self.directory)
+        self._number = 1
+        if paths:
+            self._number = int(os.path.basename(paths[-1])[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            with open(paths[-1], "rb") as last:
+                last.seek(0, os.SEEK_END)
+                if last.tell():
+                    last.seek(-1, os.SEEK_END)
+                    if last.read(1) != b"\n":
+                        self._number += 1
+        self._file = open(self._segment_path(self._number), "ab")
+
+    def _rotate(self) -> None:
+        """Закрывает текущий сегмент (со сбросом на диск) и начинает следующий."""
+        self._file.flush()
+        self._sync()
+        self._file.close()
+        self._number += 1
+        self._file = open(self._segment_path(self._number), "ab")
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}")
+
+
+def read_events(directory: str) -> Iterator[dict]:
+    """
+    События из всех сегментов по порядку записи.
+    Недописанная строка в конце сегмента (сбой во время записи) пропускается.
+    """
+    for path in segment_paths(directory):
+        with open(path, "rb") as segment:
+            for line in segment:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def query(directory: str, action: Optional[str] = None, actor_id: Optional[int] = None,
+          teacher_id: Optional[int] = None, since: Optional[str] = None,
+          until: Optional[str] = None) -> Iterator[dict]:
+    """
+    Фильтрует события журнала.
+    - since / until — границы по времени события (ISO-строки, например "2026-10-01"
+      или "2026-10-01T08:00"); время в журнале — UTC.
+    """
+    for event in read_events(directory):
+        if action and event["action"] != action:
+            continue
+        if actor_id is not None and event["actor_id"] != actor_id:
+            continue
+        if teacher_id is not None and event.get("teacher_id") != teacher_id:
+            continue
+        if since and event["ts"] < since:
+            continue
+        if until and event["ts"] >= until:
+            continue
+        yield event
+
+
+# Глобальный журнал аудита приложения (None — аудит выключен)
+audit_log: Optional[AuditLog] = None
+if AUDIT_DIR:
+    audit_log = AuditLog(
+        AUDIT_DIR,
+        segment_bytes=(AUDIT_SEGMENT_MB or 16) * 1024 * 1024,
+        fsync=AUDIT_FSYNC or "interval",
+        queue_size=AUDIT_QUEUE_SIZE or 10000,
+    )
+    # При остановке сервера дописываем то, что осталось в очереди
+    atexit.register(audit_log.close)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Просмотр журнала аудита")
+    commands = parser.add_subparsers(dest="command", required=True)
+    find = commands.add_parser("query", help="вывести события (по одному JSON на строку)")
+    find.add_argument("--dir", default=AUDIT_DIR, help="папка журнала (по умолчанию AUDIT_DIR)")
+    find.add_argument("--action", choices=["ticket.submit", "profile.update"])
+    find.add_argument("--actor", type=int, help="ID пользователя, выполнившего действие")
+    find.add_argument("--teacher", type=int, help="ID учителя, чьи талоны затронуты")
+    find.add_argument("--since", help="не раньше (UTC, ISO: 2026-10-01 или 2026-10-01T08:00)")
+    find.add_argument("--until", help="раньше (UTC, ISO)")
+    find.add_argument("--limit", type=int, help="не больше N событий")
+    args = parser.parse_args()
+
+    if not args.dir:
+        parser.error("audit directory is not set (AUDIT_DIR or --dir)")
+    for number, event in enumerate(query(args.dir, args.action, args.actor, args.teacher, args.since, args.until)):
+        if args.limit is not None and number >= args.limit:
+            break
+        print(json.dumps(event, ensure_ascii=False))
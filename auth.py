@@ -9,6 +9,7 @@ from sqlalchemy.orm import Session
 from environ_init import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_TIME
 from database import get_db
 from models import User, UserRole
+from shards import shard_for_login, use_shard, UserMoving
 
 
 # Контекст для работы с паролями (bcrypt — алгоритм хэширования)
@@ -54,31 +55,79 @@ def get_user_by_login(db: Session, login: str) -> Optional[User]:
     return db.query(User).filter(User.login == login).first()
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+def credentials_exception() -> HTTPException:
     """
-    Декодирует JWT-токен и возвращает текущего пользователя.
-    - Проверяет подпись токена и срок действия.
-    - Извлекает логин и роль.
-    - Находит пользователя в базе.
-    - Если что-то не так — выбрасывает 401 Unauthorized.
+    Ошибка 401 для неверного или просроченного токена.
     """
-    credentials_exception = HTTPException(
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def user_moving_exception() -> HTTPException:
+    """
+    Ошибка 503 на время переноса пользователя между шардами.
+    """
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="User data is being moved, retry later",
+        headers={"Retry-After": "1"},
+    )
+
+
+async def get_token_login(token: str = Depends(oauth2_scheme)) -> str:
+    """
+    Декодирует JWT-токен и возвращает логин пользователя.
+    - Проверяет подпись токена и срок действия.
+    - Извлекает логин и роль.
+    - Если что-то не так — выбрасывает 401 Unauthorized.
+    """
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         login: str = payload.get("sub")
         role: str = payload.get("role")
         if login is None or role is None:
-            raise credentials_exception
+            raise credentials_exception()
     except JWTError:
-        raise credentials_exception
+        raise credentials_exception()
+    return login
+
+
+def get_user_shard(login: str = Depends(get_token_login), db: Session = Depends(get_db)) -> int:
+    """
+    Номер шарда текущего пользователя (по справочнику в основной базе).
+    Без шардирования всегда 0 и запроса к БД нет.
+    Пока пользователя переносят в другой шард — 503 (клиент повторит запрос).
+    """
+    try:
+        shard = shard_for_login(db, login)
+    except UserMoving:
+        raise user_moving_exception()
+    if shard is None:
+        raise credentials_exception()
+    return shard
+
 
+def get_user_db(shard: int = Depends(get_user_shard), db: Session = Depends(get_db)):
+    """
+    Dependency для эндпоинтов авторизованных пользователей.
+    Отдаёт сессию шарда, в котором лежат пользователь, его столовая и талоны.
+    Без шардирования это та же сессия, что и get_db.
+    """
+    with use_shard(db, shard) as user_db:
+        yield user_db
+
+
+async def get_current_user(login: str = Depends(get_token_login), db: Session = Depends(get_user_db)) -> User:
+    """
+    Возвращает текущего пользователя по логину из токена.
+    Если пользователь не найден — выбрасывает 401 Unauthorized.
+    """
     user = get_user_by_login(db, login)
     if user is None:
-        raise credentials_exception
+        raise credentials_exception()
     return user
 
 
@@ -0,0 +1,139 @@
+"""
+Журнал изменений для дельта-синхронизации мобильных клиентов (GET /sync).
+
+При каждой подаче талона и изменении профиля в change_log добавляется
+запись в той же транзакции. В записи хранится только ссылка на сущность,
+а актуальные данные /sync читает из tickets и users. Поэтому сжатие
+журнала (оставить по одной последней записи на сущность и получателя)
+не теряет изменений, и старые курсоры остаются дешёвыми: клиент с любым
+курсором получает не больше одной записи на каждую сущность.
+
+Курсор — строка "<шард>-<id записи>". Если шард пользователя сменился
+(перенос между шардами), курсор недействителен, и клиент получает reset.
+
+Талоны и профили, появившиеся до журнала, добавляются в него при первом
+запуске приложения (журнал шарда пуст) или вручную:
+    python changelog.py init
+
+Сжатие журнала (например, раз в сутки по cron):
+    python changelog.py compact
+"""
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, literal, null, select
+from sqlalchemy.orm import Session
+
+from models import ChangeLog, ChangeEntity, Ticket, User, UserRole
+
+
+def log_ticket(db: Session, ticket: Ticket, canteen_id: Optional[int]) -> None:
+    """
+    Записывает в журнал подачу талона (для учителя и его столовой).
+    У ticket уже должен быть id (после flush).
+    """
+    db.add(ChangeLog(
+        entity=ChangeEntity.ticket,
+        entity_id=ticket.id,
+        teacher_id=ticket.teacher_id,
+        canteen_id=canteen_id,
+    ))
+
+
+def log_teacher_tickets(db: Session, teacher_id: int, canteen_id: Optional[int]) -> None:
+    """
+    Записывает в журнал все талоны учителя для столовой canteen_id.
+    Учитель сменил столовую: новая должна получить его талоны, а прежняя —
+    узнать, что их больше нет в её отчётах (/sync вернёт их с deleted=true).
+    """
+    db.execute(insert(ChangeLog).from_select(
+        ["entity", "entity_id", "teacher_id", "canteen_id"],
+        select(literal(ChangeEntity.ticket.name), Ticket.id, Ticket.teacher_id, literal(canteen_id))
+        .where(Ticket.teacher_id == teacher_id)
+    ))
+
+
+def log_profile(db: Session, user: User, canteen_ids: Iterable[Optional[int]] = ()) -> None:
+    """
+    Записывает в журнал изменение профиля.
+    - Профиль учителя видят сам учитель и его столовая; если учитель сменил
+      столовую, в canteen_ids передаётся и прежняя — чтобы она тоже узнала об этом.
+    - Профиль столовой видит сама столовая.
+    """
+    if user.role == UserRole.canteen:
+        recipients = {(None, user.id)}
+    else:
+        recipients = {(user.id, canteen_id) for canteen_id in {user.canteen_id, *canteen_ids}}
+    for teacher_id, canteen_id in recipients:
+        db.add(ChangeLog(
+            entity=ChangeEntity.profile,
+            entity_id=user.id,
+            teacher_id=teacher_id,
+            canteen_id=canteen_id,
+        ))
+
+
+def backfill(db: Session) -> int:
+    """
+    Добавляет записи о талонах и профилях, которых в журнале ещё нет (данные,
+    появившиеся до журнала) — иначе /sync без курсора их не вернёт. Получатели
+    те же, что у log_ticket / log_profile. Архивные талоны в /sync не попадают
+    и не добавляются. Возвращает количество добавленных записей.
+    """
+    def missing(entity: ChangeEntity, entity_id):
+        return entity_id.not_in(select(ChangeLog.entity_id).where(ChangeLog.entity == entity))
+
+    columns = ["entity", "entity_id", "teacher_id", "canteen_id"]
+    sources = [
+        select(literal(ChangeEntity.ticket.name), Ticket.id, Ticket.teacher_id, User.canteen_id)
+        .join(User, User.id == Ticket.teacher_id)
+        .where(missing(ChangeEntity.ticket, Ticket.id)),
+        select(literal(ChangeEntity.profile.name), User.id, User.id, User.canteen_id)
+        .where(User.role == UserRole.teacher, missing(ChangeEntity.profile, User.id)),
+        select(literal(ChangeEntity.profile.name), User.id, null(), User.id)
+        .where(User.role == UserRole.canteen, missing(ChangeEntity.profile, User.id)),
+    ]
+    added = sum(db.execute(insert(ChangeLog).from_select(columns, source)).rowcount for source in sources)
+    db.commit()
+    return added
+
+
+def format_cursor(shard: int, change_id: int) -> str:
+    return f"{shard}-{change_id}"
+
+
+def parse_cursor(cursor: str) -> Tuple[int, int]:
+    """Разбирает курсор "<шард>-<id>"; при неверном формате — ValueError."""
+    shard, change_id = cursor.split("-")
+    return int(shard), int(change_id)
+
+
+def compact(db: Session) -> int:
+    """
+    Сжимает журнал: для каждой сущности и каждого получателя оставляет
+    только последнюю запись. Возвращает количество удалённых записей.
+    """
+    latest = select(func.max(ChangeLog.id)).group_by(
+        ChangeLog.entity, ChangeLog.entity_id, ChangeLog.teacher_id, ChangeLog.canteen_id
+    )
+    removed = db.execute(delete(ChangeLog).where(ChangeLog.id.not_in(latest))).rowcount
+    db.commit()
+    return removed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database import Base, SessionLocal, shard_engines
+
+    parser = argparse.ArgumentParser(description="Обслуживание журнала изменений")
+    parser.add_argument("command", choices=["compact", "init"],
+                        help="compact — сжать журнал, init — добавить в журнал талоны и профили, которых в нём нет")
+    args = parser.parse_args()
+
+    for number, shard_engine in enumerate(shard_engines):
+        Base.metadata.create_all(bind=shard_engine)
+        with SessionLocal(bind=shard_engine) as session:
+            if args.command == "init":
+                print(f"shard {number}: added {backfill(session)} change log entries")
+            else:
+                print(f"shard {number}: removed {compact(session)} change log entries")
@@ -1,6 +1,6 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
-from environ_init import DATA_ADDRESS
+from environ_init import DATA_ADDRESS, DATA_SHARDS
 
 # Адрес подключения к базе данных
 SQLALCHEMY_DATABASE_URL = DATA_ADDRESS
@@ -13,6 +13,28 @@ engine = create_engine(
     connect_args={"check_same_thread": False}
 )
 
+# Движки шардов (см. shards.py): шард 0 — основная база, остальные — из DATA_SHARDS.
+# Если DATA_SHARDS не задан, шард один и всё работает через engine.
+shard_engines = [engine] + [
+    create_engine(address, connect_args={"check_same_thread": False})
+    for address in (DATA_SHARDS or [])
+]
+
+
+
+def _enable_wal(dbapi_connection, connection_record):
+    """
+    Режим журнала WAL для SQLite: чтения не ждут пишущую транзакцию.
+    Иначе пик подачи талонов в шарде 0 блокировал бы чтение справочника
+    user_shards, через который проходит авторизация во всех шардах.
+    """
+    dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+
+for _engine in shard_engines:
+    if _engine.dialect.name == "sqlite":
+        event.listen(_engine, "connect", _enable_wal)
+
 # Создаём фабрику сессий для работы с БД
 # autocommit=False — изменения не сохраняются автоматически, нужно явно вызывать commit()
 # autoflush=False — отключает автоматическую синхронизацию сессии с БД при каждом запросе
@@ -14,3 +14,41 @@ if not ALGORITHM: ALGORITHM = None
 
 DATA_ADDRESS = getenv('DATA_ADDRESS')
 if not DATA_ADDRESS: DATA_ADDRESS = None
+
+# Лимит памяти кэша талонов в мегабайтах (ticket_cache.py); не задан — кэш выключен
+TICKET_CACHE_MB = getenv('TICKET_CACHE_MB')
+if not TICKET_CACHE_MB: TICKET_CACHE_MB = None
+else: TICKET_CACHE_MB = int(TICKET_CACHE_MB)
+
+# Групповая запись талонов (submit_pipeline.py): окно набора пачки в мс; не задано — выключена
+SUBMIT_BATCH_MS = getenv('SUBMIT_BATCH_MS')
+if not SUBMIT_BATCH_MS: SUBMIT_BATCH_MS = None
+else: SUBMIT_BATCH_MS = int(SUBMIT_BATCH_MS)
+
+# Максимальный размер пачки (по умолчанию 64)
+SUBMIT_BATCH_SIZE = getenv('SUBMIT_BATCH_SIZE')
+if not SUBMIT_BATCH_SIZE: SUBMIT_BATCH_SIZE = None
+else: SUBMIT_BATCH_SIZE = int(SUBMIT_BATCH_SIZE)
+
+# Дополнительные шарды БД (shards.py): адреса через запятую; шард 0 — DATA_ADDRESS
+DATA_SHARDS = getenv('DATA_SHARDS')
+if not DATA_SHARDS: DATA_SHARDS = None
+else: DATA_SHARDS = [address.strip() for address in DATA_SHARDS.split(',') if address.strip()]
+
+# Журнал аудита (audit.py): папка сегментов; не задана — аудит выключен
+AUDIT_DIR = getenv('AUDIT_DIR')
+if not AUDIT_DIR: AUDIT_DIR = None
+
+# Размер сегмента журнала аудита в мегабайтах (по умолчанию 16)
+AUDIT_SEGMENT_MB = getenv('AUDIT_SEGMENT_MB')
+if not AUDIT_SEGMENT_MB: AUDIT_SEGMENT_MB = None
+else: AUDIT_SEGMENT_MB = int(AUDIT_SEGMENT_MB)
+
+# Политика fsync журнала аудита: always / interval / never (по умолчанию interval)
+AUDIT_FSYNC = getenv('AUDIT_FSYNC')
+if not AUDIT_FSYNC: AUDIT_FSYNC = None
+
+# Ёмкость очереди событий аудита (по умолчанию 10000)
+AUDIT_QUEUE_SIZE = getenv('AUDIT_QUEUE_SIZE')
+if not AUDIT_QUEUE_SIZE: AUDIT_QUEUE_SIZE = None
+else: AUDIT_QUEUE_SIZE = int(AUDIT_QUEUE_SIZE)
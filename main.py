@@ -1,12 +1,17 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from database import Base, engine
+from sqlalchemy.exc import IntegrityError
+
+from changelog import backfill
+from database import Base, SessionLocal, shard_engines
 from models import *
 from routers.auth_router import router as auth_router
 from routers.teacher_router import router as teacher_router
 from routers.canteen_router import router as canteen_router
 from routers.profile_router import router as profile_router
+from routers.sync_router import router as sync_router
+from shards import DirectoryBase, sharding_enabled, init_directory
 
 # Создаём экземпляр приложения FastAPI
 app = FastAPI(title="Mobile Talon API")
@@ -28,10 +33,32 @@ app.add_middleware(
 
 # Создание таблиц в базе данных (если их ещё нет)
 # Base.metadata содержит все модели, унаследованные от declarative_base()
-Base.metadata.create_all(bind=engine)
+# Таблицы создаются в каждом шарде; справочник шардов — только в основной базе
+for shard_engine in shard_engines:
+    Base.metadata.create_all(bind=shard_engine)
+    # create_all не добавляет новые индексы в уже существующие таблицы — досоздаём их
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=shard_engine, checkfirst=True)
+    # Журнал изменений пуст у базы, созданной до /sync: добавляем в него существующие
+    # талоны и профили, иначе первая синхронизация клиента их не вернёт
+    with SessionLocal(bind=shard_engine) as db:
+        if db.query(ChangeLog.id).first() is None:
+            backfill(db)
+if sharding_enabled:
+    DirectoryBase.metadata.create_all(bind=shard_engines[0])
+    # Если шардирование включили на существующей базе, справочник пуст и все прежние
+    # пользователи получали бы 401 — дополняем его пользователями из всех шардов
+    with SessionLocal() as directory:
+        try:
+            init_directory(directory)
+        except IntegrityError:
+            # Справочник одновременно заполнил другой воркер
+            directory.rollback()
 
 # Подключаем роутеры (разделяем API по функциональности)
 app.include_router(auth_router)      # Авторизация и регистрация
 app.include_router(profile_router)   # Работа с профилем пользователя
 app.include_router(teacher_router)   # Эндпоинты для учителей
 app.include_router(canteen_router)   # Эндпоинты для столовых
+app.include_router(sync_router)      # Дельта-синхронизация для мобильных клиентов
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, Enum, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Date, ForeignKey, Enum, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from database import Base
 import enum
@@ -10,6 +10,12 @@ class UserRole(str, enum.Enum):
     canteen = "canteen"   # Столовая
 
 
+# Что изменилось (для журнала изменений change_log)
+class ChangeEntity(str, enum.Enum):
+    ticket = "ticket"     # Талон
+    profile = "profile"   # Профиль пользователя
+
+
 class User(Base):
     __tablename__ = "users"   # Название таблицы в БД
 
@@ -22,8 +28,8 @@ class User(Base):
 
     # Дополнительные поля (актуальны только для учителей)
     class_name = Column(String, nullable=True)                      # Название класса (например "7'В'")
-    canteen_id = Column(Integer, ForeignKey("users.id"), nullable=True)
-    # Ссылка на столовую (User с ролью canteen)
+    canteen_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=True)
+    # Ссылка на столовую (User с ролью canteen); индекс — для выборки учителей столовой в отчётах
 
     # Связи
     canteen = relationship("User", remote_side=[id], uselist=False) # Связь "учитель -> столовая"
@@ -50,3 +56,42 @@ class Ticket(Base):
     __table_args__ = (
         UniqueConstraint("teacher_id", "date", name="uq_ticket_teacher_date"),
     )
+
+
+class ArchivedTicket(Base):
+    __tablename__ = "tickets_archive"   # Талоны закрытых учебных лет (см. archive.py)
+
+    # Те же поля, что и в Ticket; id у архива свой — SQLite может повторно
+    # выдавать в tickets id уже перенесённых строк
+    id = Column(Integer, primary_key=True, index=True)
+    date = Column(Date, index=True, nullable=False)
+
+    paid_count = Column(Integer, nullable=False)
+    free_count = Column(Integer, nullable=False)
+
+    class_name = Column(String, nullable=False)
+
+    teacher_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("teacher_id", "date", name="uq_ticket_archive_teacher_date"),
+    )
+
+
+class ChangeLog(Base):
+    __tablename__ = "change_log"   # Журнал изменений для синхронизации клиентов (см. changelog.py)
+
+    # id — курсор синхронизации. AUTOINCREMENT: после сжатия журнала id не выдаются повторно
+    id = Column(Integer, primary_key=True)
+    entity = Column(Enum(ChangeEntity), nullable=False)   # Что изменилось (талон / профиль)
+    entity_id = Column(Integer, nullable=False)           # ID талона или пользователя
+
+    # Кому интересно изменение: учителю и/или столовой
+    teacher_id = Column(Integer, nullable=True)
+    canteen_id = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        Index("ix_change_log_teacher_cursor", "teacher_id", "id"),
+        Index("ix_change_log_canteen_cursor", "canteen_id", "id"),
+        {"sqlite_autoincrement": True},
+    )
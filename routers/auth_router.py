@@ -2,9 +2,10 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 
 # Импортируем вспомогательные функции для работы с аутентификацией
-from auth import get_password_hash, get_user_by_login
+from auth import get_password_hash
 from database import get_db
 from models import User, UserRole
+from shards import login_taken, find_canteen_shard, least_loaded_shard, create_user
 from schemas import (
     RegisterCanteenRequest, RegisterTeacherRequest,
     UserPublic
@@ -21,9 +22,9 @@ def register_canteen(payload: RegisterCanteenRequest, db: Session = Depends(get_
     - Проверяем, что логин ещё не занят.
     - Хэшируем пароль.
     - Создаём нового пользователя с ролью 'canteen'.
-    - Сохраняем в БД и возвращаем публичные данные пользователя.
+    - Сохраняем в наименее загруженный шард БД и возвращаем публичные данные пользователя.
     """
-    if get_user_by_login(db, payload.login):
+    if login_taken(db, payload.login):
         raise HTTPException(status_code=400, detail="Login already exists")
 
     user = User(
@@ -32,10 +33,7 @@ def register_canteen(payload: RegisterCanteenRequest, db: Session = Depends(get_
         educational_institution=payload.educational_institution,
         role=UserRole.canteen
     )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
-    return user
+    return create_user(db, user, least_loaded_shard(db))
 
 
 @router.post("/teacher", response_model=UserPublic)
@@ -45,14 +43,14 @@ def register_teacher(payload: RegisterTeacherRequest, db: Session = Depends(get_
     - Проверяем, что логин ещё не занят.
     - Проверяем, что указанная столовая (canteen_id) существует.
     - Создаём нового пользователя с ролью 'teacher', привязанного к столовой.
-    - Сохраняем в БД и возвращаем публичные данные пользователя.
+    - Сохраняем в шард столовой и возвращаем публичные данные пользователя.
     """
-    if get_user_by_login(db, payload.login):
+    if login_taken(db, payload.login):
         raise HTTPException(status_code=400, detail="Login already exists")
 
-    # Проверка, что столовая существует и имеет правильную роль
-    canteen = db.query(User).filter(User.id == payload.canteen_id, User.role == UserRole.canteen).first()
-    if not canteen:
+    # Проверка, что столовая существует и имеет правильную роль (заодно узнаём её шард)
+    shard = find_canteen_shard(db, payload.canteen_id)
+    if shard is None:
         raise HTTPException(status_code=404, detail="Canteen not found")
 
     user = User(
@@ -63,10 +61,7 @@ def register_teacher(payload: RegisterTeacherRequest, db: Session = Depends(get_
         class_name=payload.class_name.strip(),  # убираем лишние пробелы
         canteen_id=payload.canteen_id
     )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
-    return user
+    return create_user(db, user, shard)
 
 
 # @router.post("/login", response_model=TokenResponse)
@@ -4,9 +4,10 @@ from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 
-from auth import require_canteen
-from database import get_db
-from models import User, UserRole, Ticket
+from archive import tickets_in_range
+from auth import require_canteen, get_user_db
+from models import User, UserRole
+from ticket_cache import ticket_cache
 from schemas import (
     CanteenDayRow, CanteenDaySummary, CanteenDayResponse,
     CanteenWeekDay, CanteenWeekResponse
@@ -19,7 +20,7 @@ router = APIRouter(prefix="/canteen", tags=["talon-canteen"])
 @router.get("/day", response_model=CanteenDayResponse)
 def daily_view(
     dt: date = Query(default=date.today()),  # Дата для отчёта (по умолчанию — сегодня)
-    db: Session = Depends(get_db),           # Сессия БД
+    db: Session = Depends(get_user_db),      # Сессия БД (шард столовой)
     canteen = Depends(require_canteen),      # Проверка, что запрос делает именно столовая
 ):
     """
@@ -33,15 +34,19 @@ def daily_view(
         User.canteen_id == canteen.id
     ).subquery()
 
-    # Агрегируем данные по талонам за выбранную дату
-    rows_raw = db.query(
-        Ticket.class_name.label("class_name"),
-        func.coalesce(func.sum(Ticket.paid_count), 0).label("paid"),
-        func.coalesce(func.sum(Ticket.free_count), 0).label("free"),
-    ).filter(
-        Ticket.teacher_id.in_(teacher_ids),
-        Ticket.date == dt
-    ).group_by(Ticket.class_name).order_by(Ticket.class_name).all()
+    # Если включён кэш талонов — берём строки из него (None — кэш не может ответить)
+    rows_raw = ticket_cache.day_rows(db, canteen.id, dt) if ticket_cache else None
+
+    if rows_raw is None:
+        # Талоны за выбранную дату (архив подключается, только если дата из закрытого учебного года)
+        tickets = tickets_in_range(dt, dt, teacher_ids)
+
+        # Агрегируем данные по талонам за выбранную дату
+        rows_raw = db.query(
+            tickets.c.class_name.label("class_name"),
+            func.coalesce(func.sum(tickets.c.paid_count), 0).label("paid"),
+            func.coalesce(func.sum(tickets.c.free_count), 0).label("free"),
+        ).group_by(tickets.c.class_name).order_by(tickets.c.class_name).all()
 
     rows: List[CanteenDayRow] = []
     total_paid = 0
@@ -75,7 +80,7 @@ def daily_view(
 @router.get("/week", response_model=CanteenWeekResponse)
 def weekly_view(
     start: date = Query(default=None),       # Начальная дата недели (если не указана — последние 7 дней)
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_user_db),
     canteen = Depends(require_canteen),
 ):
     """
@@ -99,15 +104,19 @@ def weekly_view(
     # Заготовка: словарь на 7 дней с нулями
     days_map = {start + timedelta(days=i): {"paid": 0, "free": 0} for i in range(7)}
 
-    # Агрегируем данные по талонам за неделю
-    agg = db.query(
-        Ticket.date.label("d"),
-        func.coalesce(func.sum(Ticket.paid_count), 0).label("paid"),
-        func.coalesce(func.sum(Ticket.free_count), 0).label("free"),
-    ).filter(
-        Ticket.teacher_id.in_(teacher_ids),
-        Ticket.date.between(start, end)
-    ).group_by(Ticket.date).all()
+    # Если включён кэш талонов — берём итоги по дням из него
+    agg = ticket_cache.week_rows(db, canteen.id, start, end) if ticket_cache else None
+
+    if agg is None:
+        # Талоны за неделю (с архивом, если неделя захватывает закрытый учебный год)
+        tickets = tickets_in_range(start, end, teacher_ids)
+
+        # Агрегируем данные по талонам за неделю
+        agg = db.query(
+            tickets.c.date.label("d"),
+            func.coalesce(func.sum(tickets.c.paid_count), 0).label("paid"),
+            func.coalesce(func.sum(tickets.c.free_count), 0).label("free"),
+        ).group_by(tickets.c.date).all()
 
     # Заполняем словарь данными из БД
     for row in agg:
@@ -2,8 +2,9 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 
 # Импортируем вспомогательные функции для работы с аутентификацией
-from auth import create_access_token, verify_password, get_user_by_login
+from auth import create_access_token, verify_password, get_user_by_login, user_moving_exception
 from database import get_db
+from shards import shard_for_login, use_shard, UserMoving
 from schemas import (
     LoginRequest, TokenResponse
 )
@@ -14,12 +15,20 @@ router = APIRouter(prefix="/login", tags=["login"])
 def login(payload: LoginRequest, db: Session = Depends(get_db)):
     """
     Авторизация пользователя.
-    - Проверяем, что пользователь существует.
+    - Находим шард пользователя и проверяем, что пользователь существует.
     - Сверяем пароль с хэшированным.
     - Если всё верно — создаём JWT-токен с ролью пользователя.
     - Возвращаем токен и роль.
     """
-    user = get_user_by_login(db, payload.login)
+    try:
+        shard = shard_for_login(db, payload.login)
+    except UserMoving:
+        raise user_moving_exception()
+    if shard is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid login or password")
+
+    with use_shard(db, shard) as user_db:
+        user = get_user_by_login(user_db, payload.login)
     if not user or not verify_password(payload.password, user.hashed_password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid login or password")
 
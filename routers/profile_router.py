@@ -1,10 +1,16 @@
+from contextlib import ExitStack
+
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 
-from auth import get_current_user, get_password_hash
+from audit import audit_log
+from auth import get_current_user, get_password_hash, get_user_db, get_user_shard
+from changelog import log_profile, log_teacher_tickets
 from database import get_db
 from models import User, UserRole
 from schemas import UserPublic, ProfileUpdate
+from shards import find_canteen_shard, move_users, use_shard
+from ticket_cache import ticket_cache
 
 # Роутер для работы с профилем пользователя
 router = APIRouter(prefix="/profile", tags=["profile"])
@@ -23,45 +29,85 @@ def get_me(user: User = Depends(get_current_user)):
 @router.put("/me", response_model=UserPublic)
 def update_me(
     payload: ProfileUpdate,              # Данные для обновления профиля
-    db: Session = Depends(get_db),       # Сессия базы данных
+    db: Session = Depends(get_user_db),  # Сессия базы данных (шард пользователя)
     user: User = Depends(get_current_user),  # Текущий пользователь
+    directory: Session = Depends(get_db),    # Основная база (справочник шардов)
+    shard: int = Depends(get_user_shard),    # Текущий шард пользователя
 ):
     """
     Эндпоинт для обновления профиля текущего пользователя.
     Доступные изменения:
     - educational_institution (учебное заведение)
     - password (с автоматическим хэшированием)
-    - class_name и canteen_id (только для учителей)
+    - class_name и canteen_id (только для учителей;
+      если новая столовая в другом шарде — учитель переезжает туда вместе с талонами)
     """
 
-    # Обновляем учебное заведение, если передано
-    if payload.educational_institution is not None:
-        user.educational_institution = payload.educational_institution
-
-    # Если передан новый пароль — хэшируем и сохраняем
-    if payload.password:
-        user.hashed_password = get_password_hash(payload.password)
-
-    # Дополнительные поля доступны только для учителей
-    if user.role == UserRole.teacher:
-        # Обновляем название класса
-        if payload.class_name is not None:
-            user.class_name = payload.class_name
-        # Обновляем привязку к столовой
-        if payload.canteen_id is not None:
-            canteen = db.query(User).filter(
-                User.id == payload.canteen_id,
-                User.role == UserRole.canteen
-            ).first()
-            if not canteen:
-                # Если указанной столовой нет — ошибка
-                raise HTTPException(status_code=404, detail="Canteen not found")
-            user.canteen_id = payload.canteen_id
-
-    # Сохраняем изменения в базе
-    db.add(user)
-    db.commit()
-    db.refresh(user)
+    # Запоминаем текущую столовую, чтобы после смены сбросить её отчёты в кэше
+    old_canteen_id = user.canteen_id
+    canteen_shard = shard
+
+    # Новая столовая (только для учителей) — проверяем, что она есть, и находим её шард
+    if user.role == UserRole.teacher and payload.canteen_id is not None:
+        canteen_shard = find_canteen_shard(directory, payload.canteen_id)
+        if canteen_shard is None:
+            # Если указанной столовой нет — ошибка
+            raise HTTPException(status_code=404, detail="Canteen not found")
+
+    with ExitStack() as stack:
+        # Новая столовая в другом шарде — сначала переносим учителя и его талоны к ней,
+        # а профиль меняем уже там: если перенос не удался, профиль остаётся прежним
+        if canteen_shard != shard:
+            user_id = user.id
+            move_users(directory, [user_id], shard, canteen_shard)
+            db = stack.enter_context(use_shard(directory, canteen_shard))
+            user = db.get(User, user_id)
+
+        # Обновляем учебное заведение, если передано
+        if payload.educational_institution is not None:
+            user.educational_institution = payload.educational_institution
+
+        # Если передан новый пароль — хэшируем и сохраняем
+        if payload.password:
+            user.hashed_password = get_password_hash(payload.password)
+
+        # Дополнительные поля доступны только для учителей
+        if user.role == UserRole.teacher:
+            # Обновляем название класса
+            if payload.class_name is not None:
+                user.class_name = payload.class_name
+            # Обновляем привязку к столовой
+            if payload.canteen_id is not None:
+                user.canteen_id = payload.canteen_id
+
+        # Сохраняем изменения в базе вместе с записью в журнале изменений для /sync
+        db.add(user)
+        log_profile(db, user, [old_canteen_id])
+        # Новая столовая должна получить талоны учителя, а прежняя — узнать, что их больше нет
+        # (при переезде в другой шард прежней столовой пишет move_users)
+        if user.canteen_id != old_canteen_id:
+            log_teacher_tickets(db, user.id, user.canteen_id)
+            if old_canteen_id is not None and canteen_shard == shard:
+                log_teacher_tickets(db, user.id, old_canteen_id)
+        db.commit()
+        db.refresh(user)
+
+    # Событие аудита: какие поля изменены (пароль — без значения)
+    if audit_log:
+        changes = payload.model_dump(exclude_none=True)
+        if "password" in changes:
+            changes["password"] = "***"
+        audit_log.record(
+            "profile.update",
+            actor_id=user.id,
+            teacher_id=user.id if user.role == UserRole.teacher else None,
+            old_canteen_id=old_canteen_id,
+            changes=changes,
+        )
+
+    # Талоны учителя перешли в отчёты другой столовой — сбрасываем обе матрицы в кэше
+    if ticket_cache and user.canteen_id != old_canteen_id:
+        ticket_cache.invalidate(old_canteen_id, user.canteen_id)
 
     # Возвращаем обновлённые публичные данные
     return user
@@ -0,0 +1,108 @@
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from sqlalchemy import and_, or_, select
+
+from auth import get_current_user, get_user_db, get_user_shard
+from changelog import format_cursor, parse_cursor
+from models import User, UserRole, Ticket, ChangeLog, ChangeEntity
+from schemas import SyncChange, SyncResponse, TicketOut, UserPublic
+
+# Роутер для дельта-синхронизации мобильных клиентов
+router = APIRouter(prefix="/sync", tags=["sync"])
+
+
+@router.get("", response_model=SyncResponse)
+def sync(
+    since: Optional[str] = Query(default=None),              # Курсор из прошлого ответа (пусто — всё с начала)
+    limit: int = Query(default=500, ge=1, le=1000),          # Максимум записей журнала за один запрос
+    db: Session = Depends(get_user_db),                      # Сессия БД (шард пользователя)
+    user: User = Depends(get_current_user),                  # Текущий пользователь
+    shard: int = Depends(get_user_shard),                    # Шард пользователя (часть курсора)
+):
+    """
+    Изменения с момента курсора since.
+    - Учитель получает свои талоны и свой профиль.
+    - Столовая получает талоны всех своих учителей, их профили и свой профиль.
+    - Каждая сущность возвращается один раз, в актуальном состоянии.
+    """
+
+    # Разбираем курсор; курсор другого шарда (после переноса) означает полную пересинхронизацию
+    last_id = 0
+    reset = False
+    if since:
+        try:
+            cursor_shard, last_id = parse_cursor(since)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if cursor_shard != shard:
+            last_id = 0
+            reset = True
+
+    # Записи журнала, адресованные этому пользователю (индексы по (teacher_id, id) и (canteen_id, id))
+    if user.role == UserRole.teacher:
+        recipient = ChangeLog.teacher_id == user.id
+    else:
+        recipient = ChangeLog.canteen_id == user.id
+    entries = db.query(ChangeLog.id, ChangeLog.entity, ChangeLog.entity_id).filter(
+        recipient,
+        ChangeLog.id > last_id
+    ).order_by(ChangeLog.id).limit(limit + 1).all()
+
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    # Оставляем по одной (последней) записи на сущность, сохраняя порядок журнала
+    latest = {}
+    for entry in entries:
+        latest.pop((entry.entity, entry.entity_id), None)
+        latest[(entry.entity, entry.entity_id)] = entry.id
+
+    ticket_ids = [entity_id for entity, entity_id in latest if entity == ChangeEntity.ticket]
+    profile_ids = [entity_id for entity, entity_id in latest if entity == ChangeEntity.profile]
+
+    # Загружаем актуальные данные одним запросом на тип; чужие сущности отсеиваем
+    if user.role == UserRole.teacher:
+        own_tickets = Ticket.teacher_id == user.id
+        own_profiles = User.id == user.id
+    else:
+        teacher_ids = select(User.id).where(User.role == UserRole.teacher, User.canteen_id == user.id)
+        own_tickets = Ticket.teacher_id.in_(teacher_ids)
+        own_profiles = or_(User.id == user.id, and_(User.role == UserRole.teacher, User.canteen_id == user.id))
+
+    tickets = {}
+    if ticket_ids:
+        tickets = {t.id: t for t in db.query(Ticket).filter(Ticket.id.in_(ticket_ids), own_tickets)}
+    profiles = {}
+    if profile_ids:
+        profiles = {u.id: u for u in db.query(User).filter(User.id.in_(profile_ids), own_profiles)}
+
+    # Формируем список изменений
+    changes: List[SyncChange] = []
+    for entity, entity_id in latest:
+        if entity == ChangeEntity.ticket:
+            t = tickets.get(entity_id)
+            changes.append(SyncChange(
+                entity=entity,
+                id=entity_id,
+                deleted=t is None,
+                ticket=TicketOut(
+                    id=t.id,
+                    date=t.date,
+                    class_name=t.class_name,
+                    paid_count=t.paid_count,
+                    free_count=t.free_count,
+                    total=t.paid_count + t.free_count
+                ) if t else None
+            ))
+        else:
+            u = profiles.get(entity_id)
+            changes.append(SyncChange(
+                entity=entity,
+                id=entity_id,
+                deleted=u is None,
+                profile=UserPublic.model_validate(u) if u else None
+            ))
+
+    cursor = format_cursor(shard, entries[-1].id if entries else last_id)
+    return SyncResponse(cursor=cursor, reset=reset, has_more=has_more, changes=changes)
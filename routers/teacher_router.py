@@ -2,10 +2,15 @@ from datetime import date, timedelta
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 
-from auth import require_teacher
-from database import get_db
-from models import Ticket
+from archive import hot_boundary, tickets_in_range, archived_ticket_exists
+from audit import audit_log
+from auth import require_teacher, get_user_db, user_moving_exception
+from changelog import log_ticket
+from models import Ticket, User
+from shards import UserMoving, sharding_enabled
 from schemas import TicketCreate, TicketOut
+from submit_pipeline import submit_pipeline, DuplicateTicket, SubmitTimeout
+from ticket_cache import ticket_cache
 
 # Роутер для работы с талонами (учительская часть)
 router = APIRouter(prefix="/teacher", tags=["talon-teacher"])
@@ -14,38 +19,90 @@ router = APIRouter(prefix="/teacher", tags=["talon-teacher"])
 @router.post("/submit", response_model=TicketOut)
 def submit_ticket(
     payload: TicketCreate,                 # Данные, которые передаёт учитель (кол-во талонов, дата)
-    db: Session = Depends(get_db),        # Сессия базы данных
+    db: Session = Depends(get_user_db),   # Сессия базы данных (шард учителя)
     teacher = Depends(require_teacher),   # Проверка, что запрос делает именно учитель
 ):
     """
     Эндпоинт для подачи талонов учителем.
     - Если дата не указана — используется текущая.
     - Проверяется, что на эту дату учитель ещё не подавал талон.
-    - Создаётся новая запись Ticket и сохраняется в БД.
+    - Создаётся новая запись Ticket и сохраняется в БД
+      (при включённой групповой записи — пачкой вместе с другими талонами).
     """
 
     # Если дата не указана — берём сегодняшнюю
     target_date = payload.date or date.today()
 
-    # Проверяем, не существует ли уже талон на эту дату от этого учителя
-    existing = db.query(Ticket).filter(
-        Ticket.teacher_id == teacher.id,
-        Ticket.date == target_date
-    ).first()
-    if existing:
-        raise HTTPException(status_code=409, detail="Ticket for this date already submitted")
+    if submit_pipeline:
+        # Групповая запись: проверка дубликатов и commit выполняются пачкой в фоновом потоке
+        try:
+            ticket = submit_pipeline.submit(
+                bind=db.get_bind(),   # движок шарда учителя
+                teacher_id=teacher.id,
+                canteen_id=teacher.canteen_id,
+                class_name=teacher.class_name or "N/A",
+                target_date=target_date,
+                paid_count=payload.paid_count,
+                free_count=payload.free_count,
+            )
+        except DuplicateTicket:
+            raise HTTPException(status_code=409, detail="Ticket for this date already submitted")
+        except UserMoving:
+            raise user_moving_exception()
+        except SubmitTimeout:
+            # Пачка не записана вовремя — клиент повторит запрос
+            raise HTTPException(status_code=503, detail="Ticket was not saved in time, try again",
+                                headers={"Retry-After": "1"})
+    else:
+        # Проверяем, не существует ли уже талон на эту дату от этого учителя
+        existing = db.query(Ticket).filter(
+            Ticket.teacher_id == teacher.id,
+            Ticket.date == target_date
+        ).first()
+        # Дата из закрытого учебного года — талон может лежать уже в архиве
+        if not existing and target_date < hot_boundary():
+            existing = archived_ticket_exists(db, teacher.id, target_date)
+        if existing:
+            raise HTTPException(status_code=409, detail="Ticket for this date already submitted")
 
-    # Создаём новый талон
-    ticket = Ticket(
-        date=target_date,
-        paid_count=payload.paid_count,
-        free_count=payload.free_count,   # льготные (free) талоны
-        class_name=teacher.class_name or "N/A",
-        teacher_id=teacher.id,
-    )
-    db.add(ticket)
-    db.commit()
-    db.refresh(ticket)
+        # Создаём новый талон
+        ticket = Ticket(
+            date=target_date,
+            paid_count=payload.paid_count,
+            free_count=payload.free_count,   # льготные (free) талоны
+            class_name=teacher.class_name or "N/A",
+            teacher_id=teacher.id,
+        )
+        db.add(ticket)
+        db.flush()
+        # INSERT уже держит блокировку записи шарда. Если учителя за это время
+        # перенесли в другой шард (shards.move_users), его строки здесь нет,
+        # и талон потерялся бы — откатываем, клиент повторит запрос в новом шарде
+        if sharding_enabled and db.query(User.id).filter(User.id == teacher.id).first() is None:
+            db.rollback()
+            raise user_moving_exception()
+        # Запись в журнал изменений для /sync — в той же транзакции
+        log_ticket(db, ticket, teacher.canteen_id)
+        db.commit()
+        db.refresh(ticket)
+
+    # Обновляем матрицу столовой в кэше талонов (если кэш включён)
+    if ticket_cache:
+        ticket_cache.record(teacher.canteen_id, ticket)
+
+    # Событие аудита ставится в очередь без ожидания записи (если аудит включён)
+    if audit_log:
+        audit_log.record(
+            "ticket.submit",
+            actor_id=teacher.id,
+            teacher_id=teacher.id,
+            canteen_id=teacher.canteen_id,
+            ticket_id=ticket.id,
+            date=ticket.date,
+            class_name=ticket.class_name,
+            paid_count=ticket.paid_count,
+            free_count=ticket.free_count,
+        )
 
     # Возвращаем данные в формате схемы TicketOut
     return TicketOut(
@@ -59,7 +116,7 @@ def submit_ticket(
 
 
 def get_teacher_week(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_user_db),
     teacher = Depends(require_teacher),
 ):
     """
@@ -71,10 +128,9 @@ def get_teacher_week(
     end = date.today()
     start = end - timedelta(days=6)
 
-    tickets = db.query(Ticket).filter(
-        Ticket.teacher_id == teacher.id,
-        Ticket.date.between(start, end)
-    ).order_by(Ticket.date.desc()).all()
+    # В начале сентября неделя может захватить уже заархивированный прошлый учебный год
+    source = tickets_in_range(start, end, [teacher.id])
+    tickets = db.query(source).order_by(source.c.date.desc()).all()
 
     return [
         TicketOut(
@@ -1,7 +1,7 @@
 from datetime import date
 from typing import Optional, List
 from pydantic import BaseModel, Field
-from models import UserRole
+from models import UserRole, ChangeEntity
 
 
 # --------- Auth & Users ---------
@@ -156,3 +156,35 @@ class CanteenWeekResponse(BaseModel):
     grand_total_paid: int
     grand_total_free: int
     grand_total_all: int
+
+
+# --------- Sync (дельта-синхронизация для мобильных клиентов) ---------
+class SyncChange(BaseModel):
+    """
+    Одно изменение из журнала.
+    - entity: что изменилось (ticket / profile)
+    - id: ID талона или пользователя
+    - deleted: сущность больше не относится к пользователю
+      (например, учитель перешёл в другую столовую) — клиенту нужно её удалить
+    - ticket / profile: актуальные данные сущности (если не deleted)
+    """
+    entity: ChangeEntity
+    id: int
+    deleted: bool = False
+    ticket: Optional[TicketOut] = None
+    profile: Optional[UserPublic] = None
+
+
+class SyncResponse(BaseModel):
+    """
+    Ответ /sync.
+    - cursor: курсор для следующего запроса
+    - reset: курсор устарел — клиенту нужно очистить локальные данные,
+      в changes при этом приходит полный набор
+    - has_more: есть ещё изменения, нужно повторить запрос с новым курсором
+    - changes: изменения по порядку
+    """
+    cursor: str
+    reset: bool = False
+    has_more: bool = False
+    changes: List[SyncChange]
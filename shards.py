@@ -0,0 +1,409 @@
+"""
+Шардирование по столовым: каждая столовая вместе со своими учителями и
+талонами живёт в одной из N баз (database.shard_engines). Так пик записи
+одной школы не блокирует запись в остальных.
+
+- Шард 0 — основная база (DATA_ADDRESS), в ней же хранится справочник
+  user_shards: глобальный ID пользователя, логин, роль и номер шарда.
+  ID пользователей выдаёт справочник, поэтому они уникальны во всех шардах.
+- Шард пользователя определяется по логину из токена при каждом запросе
+  (auth.get_user_shard), поэтому переносы между шардами не ломают токены.
+- Справочник читается при каждом запросе, поэтому шард 0 отдан под него:
+  новые столовые попадают в наименее загруженный из шардов 1..N (учитель —
+  в шард своей столовой), а rebalance выносит из шарда 0 столовые, оставшиеся
+  там с тех пор, когда база была одна.
+- Если DATA_SHARDS не задан, шард один: справочник не используется и
+  все функции модуля работают с основной базой напрямую.
+
+Обслуживание:
+    python shards.py init              # заполнить справочник из существующих баз
+    python shards.py status            # загрузка шардов и прерванные переносы
+    python shards.py move 7 2          # перенести столовую 7 в шард 2
+    python shards.py rebalance [--dry-run]
+"""
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from sqlalchemy import Column, Integer, String, Enum, and_, delete, func, insert, literal, null, select
+from sqlalchemy.orm import Session, declarative_base
+
+from changelog import log_profile
+from database import SessionLocal, shard_engines
+from models import User, UserRole, Ticket, ArchivedTicket, ChangeLog, ChangeEntity
+
+# Включено ли шардирование (больше одной базы)
+sharding_enabled = len(shard_engines) > 1
+
+# Справочник хранится только в основной базе, поэтому у него своя metadata
+DirectoryBase = declarative_base()
+
+
+class UserShard(DirectoryBase):
+    __tablename__ = "user_shards"   # Справочник: в каком шарде живёт пользователь
+
+    id = Column(Integer, primary_key=True)                          # Глобальный ID пользователя
+    login = Column(String, unique=True, index=True, nullable=False) # Логин (уникален во всех шардах)
+    role = Column(Enum(UserRole), nullable=False)                   # Роль (teacher / canteen)
+    shard = Column(Integer, index=True, nullable=False)             # Номер шарда
+
+
+class UserMove(DirectoryBase):
+    __tablename__ = "user_moves"    # Пользователи, которых сейчас переносят между шардами
+
+    id = Column(Integer, primary_key=True)      # Глобальный ID пользователя
+    src = Column(Integer, nullable=False)       # Шард, откуда переносим
+    dst = Column(Integer, nullable=False)       # Шард, куда переносим
+
+
+class UserMoving(Exception):
+    """Пользователь переносится между шардами — запрос нужно повторить позже."""
+
+
+@contextmanager
+def use_shard(directory: Session, shard: int):
+    """
+    Сессия указанного шарда. Для шарда 0 возвращается сама сессия основной
+    базы: открывать вторую сессию к тому же файлу SQLite незачем.
+    """
+    if shard == 0:
+        yield directory
+        return
+    db = SessionLocal(bind=shard_engines[shard])
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def shard_for_login(directory: Session, login: str) -> Optional[int]:
+    """
+    Номер шарда пользователя или None, если логин неизвестен.
+    Если пользователя сейчас переносят в другой шард — UserMoving.
+    """
+    if not sharding_enabled:
+        return 0
+    entry = directory.query(UserShard.shard, UserMove.id).outerjoin(
+        UserMove, UserMove.id == UserShard.id
+    ).filter(UserShard.login == login).first()
+    if entry is None:
+        return None
+    if entry[1] is not None:
+        raise UserMoving(login)
+    return entry[0]
+
+
+def login_taken(directory: Session, login: str) -> bool:
+    """Проверяет, занят ли логин (во всех шардах)."""
+    if not sharding_enabled:
+        return directory.query(User.id).filter(User.login == login).first() is not None
+    return directory.query(UserShard.id).filter(UserShard.login == login).first() is not None
+
+
+def find_canteen_shard(directory: Session, canteen_id: int) -> Optional[int]:
+    """Номер шарда столовой или None, если такой столовой нет."""
+    if not sharding_enabled:
+        exists = directory.query(User.id).filter(
+            User.id == canteen_id,
+            User.role == UserRole.canteen
+        ).first()
+        return 0 if exists else None
+    return directory.query(UserShard.shard).filter(
+        UserShard.id == canteen_id,
+        UserShard.role == UserRole.canteen
+    ).scalar()
+
+
+def shard_loads(directory: Session) -> Dict[int, int]:
+    """Загрузка шардов — количество пользователей в каждом (включая пустые шарды)."""
+    loads = {shard: 0 for shard in range(len(shard_engines))}
+    if not sharding_enabled:
+        loads[0] = directory.query(func.count(User.id)).scalar()
+        return loads
+    for shard, count in directory.query(UserShard.shard, func.count(UserShard.id)).group_by(UserShard.shard):
+        loads[shard] = count
+    return loads
+
+
+def least_loaded_shard(directory: Session) -> int:
+    """Шард для новой столовой — тот из шардов 1..N, где меньше всего пользователей."""
+    if not sharding_enabled:
+        return 0
+    loads = shard_loads(directory)
+    return min((shard for shard in loads if shard != 0), key=lambda shard: (loads[shard], shard))
+
+
+def create_user(directory: Session, user: User, shard: int) -> User:
+    """
+    Сохраняет нового пользователя в указанный шард.
+    - ID выдаётся справочником, запись в справочнике фиксируется первой,
+      чтобы логин нельзя было занять дважды.
+    - Если запись в шард не удалась, запись справочника удаляется.
+    Возвращает сохранённого пользователя (отсоединённого от сессии шарда).
+    """
+    if not sharding_enabled:
+        directory.add(user)
+        directory.flush()
+        log_profile(directory, user)
+        directory.commit()
+        directory.refresh(user)
+        return user
+
+    entry = UserShard(login=user.login, role=user.role, shard=shard)
+    directory.add(entry)
+    directory.flush()
+    user.id = entry.id
+    if shard == 0:
+        directory.add(user)
+        log_profile(directory, user)
+        directory.commit()
+        directory.refresh(user)
+        return user
+
+    directory.commit()
+    try:
+        with use_shard(directory, shard) as db:
+            db.add(user)
+            log_profile(db, user)
+            db.commit()
+            db.refresh(user)
+            db.expunge(user)
+    except Exception:
+        directory.delete(entry)
+        directory.commit()
+        raise
+    return user
+
+
+def _copy_tickets(source, target, user_ids: List[int], bounds, canteen_of) -> int:
+    """
+    Копирует талоны (и архивные) пользователей user_ids из source в target — только
+    строки с ID больше bounds[таблица]; bounds сдвигается на наибольший скопированный ID.
+    Талоны получают новые ID, в журнал изменений target добавляются записи о них.
+    Возвращает количество скопированных строк.
+    """
+    copied = 0
+    for table in (Ticket.__table__, ArchivedTicket.__table__):
+        rows = source.execute(
+            select(table).where(table.c.teacher_id.in_(user_ids), table.c.id > bounds[table])
+        ).mappings().all()
+        if not rows:
+            continue
+        bounds[table] = max(row["id"] for row in rows)
+        last_id = target.execute(select(func.max(table.c.id))).scalar() or 0
+        target.execute(insert(table), [{k: v for k, v in row.items() if k != "id"} for row in rows])
+        copied += len(rows)
+
+        # Журнал изменений шарда dst: талоны с новыми ID
+        if table is Ticket.__table__:
+            target.execute(insert(ChangeLog), [
+                {"entity": ChangeEntity.ticket, "entity_id": ticket.id,
+                 "teacher_id": ticket.teacher_id, "canteen_id": canteen_of[ticket.teacher_id]}
+                for ticket in target.execute(select(Ticket.id, Ticket.teacher_id).where(
+                    Ticket.teacher_id.in_(user_ids), Ticket.id > last_id
+                ))
+            ])
+    return copied
+
+
+def move_users(directory: Session, user_ids: List[int], src: int, dst: int) -> int:
+    """
+    Переносит пользователей вместе с их талонами (и архивными) из шарда src в dst.
+    ID пользователей глобальные и сохраняются, талоны получают новые ID в шарде dst.
+    Порядок:
+    1. пользователи помечаются в справочнике (user_moves) — их новые запросы
+       получают 503 (UserMoving), пока идёт перенос;
+    2. копирование в dst, переключение справочника на dst;
+    3. докопирование талонов, которые успели записать в src запросы, начатые
+       до установки метки;
+    4. одна транзакция в src: она первой же записью берёт блокировку записи,
+       докопирует то, что появилось после шага 3, и удаляет пользователей и
+       все их талоны. Пока она идёт, новые талоны в src записаться не могут,
+       а после неё подача талона в src видит, что учителя там нет, и
+       откатывается с 503 (см. teacher_router.submit_ticket) — принятый
+       сервером талон не может пропасть.
+    Журнал изменений в dst пополняется записями о перенесённых талонах и профилях,
+    а в src удаляются записи перенесённых столовых (их клиенты всё равно получат reset).
+    Столовая, которая остаётся в src, получает записи об ушедших учителях и их талонах.
+    Возвращает количество перенесённых талонов.
+    """
+    if src == dst or not user_ids:
+        return 0
+    directory.add_all([UserMove(id=user_id, src=src, dst=dst) for user_id in user_ids])
+    directory.commit()
+    try:
+        return _move_users(directory, user_ids, src, dst)
+    finally:
+        directory.rollback()
+        directory.query(UserMove).filter(UserMove.id.in_(user_ids)).delete(synchronize_session=False)
+        directory.commit()
+
+
+def _move_users(directory: Session, user_ids: List[int], src: int, dst: int) -> int:
+    """Перенос пользователей, уже помеченных в user_moves (см. move_users)."""
+    users = User.__table__
+    bounds = {Ticket.__table__: 0, ArchivedTicket.__table__: 0}
+
+    with shard_engines[src].connect() as source, shard_engines[dst].begin() as target:
+        rows = source.execute(select(users).where(users.c.id.in_(user_ids))).mappings().all()
+        if rows:
+            target.execute(insert(users), [dict(row) for row in rows])
+        canteen_of = {row["id"]: row["canteen_id"] for row in rows}
+        moved = _copy_tickets(source, target, user_ids, bounds, canteen_of)
+
+        # Журнал изменений шарда dst: профили
+        if rows:
+            target.execute(insert(ChangeLog), [
+                {"entity": ChangeEntity.profile, "entity_id": row["id"],
+                 "teacher_id": None if row["role"] == UserRole.canteen else row["id"],
+                 "canteen_id": row["id"] if row["role"] == UserRole.canteen else row["canteen_id"]}
+                for row in rows
+            ])
+
+    directory.query(UserShard).filter(UserShard.id.in_(user_ids)).update(
+        {UserShard.shard: dst}, synchronize_session=False
+    )
+    directory.commit()
+
+    # Талоны, записанные в src между копированием и переключением справочника
+    with shard_engines[src].connect() as source, shard_engines[dst].begin() as target:
+        moved += _copy_tickets(source, target, user_ids, bounds, canteen_of)
+
+    with shard_engines[src].begin() as source:
+        # Первая запись берёт блокировку записи src до конца транзакции:
+        # после неё ни один талон перенесённых учителей в src уже не появится
+        source.execute(delete(ChangeLog).where(ChangeLog.canteen_id.in_(user_ids)))
+        with shard_engines[dst].begin() as target:
+            moved += _copy_tickets(source, target, user_ids, bounds, canteen_of)
+
+        # Учителя ушли из столовой, которая остаётся в src: она должна узнать,
+        # что их талоны и профили пропали (/sync вернёт их с deleted=true)
+        departed = and_(users.c.id.in_(user_ids), users.c.canteen_id.not_in(user_ids))
+        source.execute(insert(ChangeLog).from_select(
+            ["entity", "entity_id", "teacher_id", "canteen_id"],
+            select(literal(ChangeEntity.ticket.name), Ticket.id, null(), users.c.canteen_id)
+            .join(users, users.c.id == Ticket.teacher_id)
+            .where(departed)
+        ))
+        source.execute(insert(ChangeLog).from_select(
+            ["entity", "entity_id", "teacher_id", "canteen_id"],
+            select(literal(ChangeEntity.profile.name), users.c.id, null(), users.c.canteen_id)
+            .where(departed, users.c.role == UserRole.teacher)
+        ))
+        for table in bounds:
+            source.execute(delete(table).where(table.c.teacher_id.in_(user_ids)))
+        source.execute(delete(users).where(users.c.id.in_(user_ids)))
+    return moved
+
+
+def move_canteen(directory: Session, canteen_id: int, dst: int) -> int:
+    """Переносит столовую со всеми её учителями и талонами в шард dst."""
+    src = find_canteen_shard(directory, canteen_id)
+    if src is None:
+        raise ValueError(f"Canteen {canteen_id} not found")
+    with use_shard(directory, src) as db:
+        teacher_ids = [row.id for row in db.query(User.id).filter(User.canteen_id == canteen_id)]
+    return move_users(directory, [canteen_id] + teacher_ids, src, dst)
+
+
+def canteen_sizes(directory: Session, shard: int) -> Dict[int, int]:
+    """Размер каждой столовой шарда: сама столовая + её учителя."""
+    with use_shard(directory, shard) as db:
+        sizes = {row.id: 1 for row in db.query(User.id).filter(User.role == UserRole.canteen)}
+        for canteen_id, count in db.query(User.canteen_id, func.count(User.id)).filter(
+            User.role == UserRole.teacher
+        ).group_by(User.canteen_id):
+            if canteen_id in sizes:
+                sizes[canteen_id] += count
+    return sizes
+
+
+def plan_rebalance(directory: Session):
+    """
+    План выравнивания. Сначала все столовые шарда 0 (от больших к меньшим)
+    уходят в наименее загруженный из шардов 1..N. Затем жадно: пока перенос
+    одной столовой из самого загруженного шарда в самый свободный уменьшает
+    разницу между ними, переносим ту, чей размер ближе всего к половине разницы.
+    Возвращает список (canteen_id, src, dst).
+    """
+    if not sharding_enabled:
+        return []
+    loads = shard_loads(directory)
+    sizes = {shard: canteen_sizes(directory, shard) for shard in loads}
+    moves = []
+    for canteen_id, size in sorted(sizes[0].items(), key=lambda item: -item[1]):
+        dst = min((shard for shard in loads if shard != 0), key=lambda shard: (loads[shard], shard))
+        moves.append((canteen_id, 0, dst))
+        sizes[dst][canteen_id] = sizes[0].pop(canteen_id)
+        loads[0] -= size
+        loads[dst] += size
+
+    data_loads = {shard: load for shard, load in loads.items() if shard != 0}
+    while True:
+        src = max(data_loads, key=lambda shard: data_loads[shard])
+        dst = min(data_loads, key=lambda shard: data_loads[shard])
+        gap = data_loads[src] - data_loads[dst]
+        candidates = [(cid, size) for cid, size in sizes[src].items() if 0 < size < gap]
+        if not candidates:
+            return moves
+        canteen_id, size = min(candidates, key=lambda item: abs(gap / 2 - item[1]))
+        moves.append((canteen_id, src, dst))
+        sizes[dst][canteen_id] = sizes[src].pop(canteen_id)
+        data_loads[src] -= size
+        data_loads[dst] += size
+
+
+def init_directory(directory: Session) -> int:
+    """
+    Заполняет справочник пользователями, которых в нём ещё нет
+    (например, при переходе от одной базы к нескольким). Возвращает число добавленных.
+    """
+    known = {row.id for row in directory.query(UserShard.id)}
+    added = 0
+    for shard in range(len(shard_engines)):
+        with use_shard(directory, shard) as db:
+            users = db.query(User.id, User.login, User.role).all()
+        for user in users:
+            if user.id not in known:
+                directory.add(UserShard(id=user.id, login=user.login, role=user.role, shard=shard))
+                known.add(user.id)
+                added += 1
+    directory.commit()
+    return added
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database import Base
+
+    parser = argparse.ArgumentParser(description="Обслуживание шардов")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("init", help="заполнить справочник из существующих баз")
+    commands.add_parser("status", help="показать загрузку шардов")
+    move = commands.add_parser("move", help="перенести столовую в другой шард")
+    move.add_argument("canteen_id", type=int)
+    move.add_argument("shard", type=int)
+    rebalance = commands.add_parser("rebalance", help="выровнять загрузку шардов")
+    rebalance.add_argument("--dry-run", action="store_true", help="только показать план")
+    args = parser.parse_args()
+
+    for shard_engine in shard_engines:
+        Base.metadata.create_all(bind=shard_engine)
+    DirectoryBase.metadata.create_all(bind=shard_engines[0])
+
+    with SessionLocal() as session:
+        if args.command == "init":
+            print(f"Added {init_directory(session)} users to the shard directory")
+        elif args.command == "status":
+            for number, load in shard_loads(session).items():
+                print(f"shard {number}: {load} users")
+            # Метки остаются, только если процесс переноса был прерван — такие переносы нужно проверить вручную
+            for entry in session.query(UserMove):
+                print(f"user {entry.id}: moving shard {entry.src} -> {entry.dst}")
+        elif args.command == "move":
+            print(f"Moved {move_canteen(session, args.canteen_id, args.shard)} tickets")
+        else:
+            for canteen_id, src, dst in plan_rebalance(session):
+                print(f"canteen {canteen_id}: shard {src} -> {dst}")
+                if not args.dry_run:
+                    move_canteen(session, canteen_id, dst)
@@ -0,0 +1,221 @@
+"""
+Групповая запись талонов (group commit) для утреннего пика подачи.
+
+В SQLite каждая транзакция записи берёт блокировку всей базы, поэтому
+одновременные submit_ticket выстраиваются в очередь, и каждый платит за
+собственный commit. Конвейер складывает поступающие талоны в очередь,
+а фоновый поток записывает их пачками: одна транзакция на пачку, которая
+набирается не дольше SUBMIT_BATCH_MS миллисекунд или до SUBMIT_BATCH_SIZE
+талонов. Каждый запрос по-прежнему получает свой результат — сохранённый
+талон, DuplicateTicket (409) или UserMoving (503: учителя переносят в
+другой шард). Если пачка не записана за timeout секунд (поток записи
+завис, база заблокирована), запрос получает SubmitTimeout (503).
+
+У каждого шарда БД (shards.py) своя очередь и свой поток записи, так что
+пачки разных шардов записываются параллельно.
+
+Включается переменной окружения SUBMIT_BATCH_MS; без неё талоны
+сохраняются как раньше, каждый в своей транзакции.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import tuple_
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from archive import hot_boundary, archived_ticket_exists
+from changelog import log_ticket
+from database import SessionLocal
+from environ_init import SUBMIT_BATCH_MS, SUBMIT_BATCH_SIZE
+from models import Ticket, User
+from shards import UserMoving, sharding_enabled
+
+
+class DuplicateTicket(Exception):
+    """Талон этого учителя на эту дату уже подан."""
+
+
+class SubmitTimeout(Exception):
+    """
+    Пачка с талоном не записана за отведённое время.
+    Талон ещё может быть записан позже — тогда повторная подача получит 409.
+    """
+
+
+class PendingTicket:
+    """Талон, ожидающий записи, и Future, через который вернётся результат."""
+    __slots__ = ("values", "canteen_id", "future")
+
+    def __init__(self, canteen_id: Optional[int], **values):
+        self.values = values           # поля Ticket
+        self.canteen_id = canteen_id   # столовая учителя (для журнала изменений)
+        self.future = Future()
+
+    @property
+    def key(self):
+        return self.values["teacher_id"], self.values["date"]
+
+
+class SubmitPipeline:
+    """
+    Очереди талонов и фоновые потоки, записывающие их пачками
+    (по одной очереди и одному потоку на каждый движок БД, создаются при первом талоне).
+    - session_factory: фабрика сессий (по умолчанию SessionLocal)
+    - max_batch: максимальный размер пачки
+    - max_wait_ms: сколько ждать добора пачки после первого талона
+    - timeout: сколько запрос ждёт записи своей пачки, секунд
+    """
+
+    def __init__(self, session_factory=SessionLocal, max_batch: int = 64, max_wait_ms: int = 5,
+                 timeout: float = 10):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.timeout = timeout
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def _queue_for(self, bind: Engine) -> "queue.Queue[PendingTicket]":
+        """Очередь движка; при первом обращении запускает для неё поток записи."""
+        with self._lock:
+            pending_queue = self._queues.get(bind)
+            if pending_queue is None:
+                pending_queue = self._queues[bind] = queue.Queue()
+                threading.Thread(
+                    target=self._run, args=(bind, pending_queue),
+                    name=f"submit-pipeline-{len(self._queues)}", daemon=True
+                ).start()
+            return pending_queue
+
+    def submit(self, bind: Engine, teacher_id: int, canteen_id: Optional[int], class_name: str,
+               target_date: date, paid_count: int, free_count: int) -> Ticket:
+        """
+        Ставит талон в очередь движка bind (шарда учителя) и ждёт,
+        пока пачка с ним будет записана.
+        Возвращает сохранённый Ticket (отсоединённый от сессии)
+        или выбрасывает DuplicateTicket / SubmitTimeout.
+        """
+        pending = PendingTicket(
+            canteen_id,
+            date=target_date,
+            paid_count=paid_count,
+            free_count=free_count,
+            class_name=class_name,
+            teacher_id=teacher_id,
+        )
+        self._queue_for(bind).put(pending)
+        try:
+            return pending.future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise SubmitTimeout()
+
+    def _run(self, bind: Engine, pending_queue: "queue.Queue[PendingTicket]") -> None:
+        """
+        Фоновый цикл одного движка: набирает пачку и записывает её.
+        Ошибка записи достаётся запросам этой пачки, а поток продолжает работу.
+        """
+        while True:
+            batch = [pending_queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(pending_queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self._flush(bind, batch)
+            except Exception as exc:
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(exc)
+
+    def _flush(self, bind: Engine, batch) -> None:
+        """
+        Записывает пачку одной транзакцией. Если другой процесс успел вставить
+        конфликтующий талон (IntegrityError), пачка откатывается и талоны
+        записываются по одному, чтобы ошибка досталась только своему запросу.
+        """
+        # expire_on_commit=False — после commit талоны остаются читаемыми без повторного SELECT
+        with self.session_factory(bind=bind, expire_on_commit=False) as db:
+            try:
+                results = self._write(db, batch)
+            except IntegrityError:
+                db.rollback()
+                results = [self._write_one(db, pending) for pending in batch]
+            except Exception as exc:
+                db.rollback()
+                results = [(pending, exc) for pending in batch]
+
+        for pending, result in results:
+            if isinstance(result, Exception):
+                pending.future.set_exception(result)
+            else:
+                pending.future.set_result(result)
+
+    def _write_one(self, db: Session, pending: PendingTicket):
+        """Записывает один талон в своей транзакции; любая ошибка достаётся только ему."""
+        try:
+            return self._write(db, [pending])[0]
+        except IntegrityError:
+            db.rollback()
+            return pending, DuplicateTicket()
+        except Exception as exc:
+            db.rollback()
+            return pending, exc
+
+    def _write(self, db: Session, batch):
+        """
+        Проверяет дубликаты одним запросом на всю пачку, вставляет новые талоны
+        вместе с записями журнала изменений и фиксирует транзакцию.
+        Возвращает пары (PendingTicket, Ticket | DuplicateTicket | UserMoving).
+        """
+        keys = {p.key for p in batch}
+        taken = set(db.query(Ticket.teacher_id, Ticket.date).filter(
+            tuple_(Ticket.teacher_id, Ticket.date).in_(keys)
+        ).all())
+
+        boundary = hot_boundary()
+        results = []
+        for pending in batch:
+            key = pending.key
+            # Дубликат в БД, в архиве или внутри этой же пачки
+            if key in taken or (key[1] < boundary and archived_ticket_exists(db, *key)):
+                results.append((pending, DuplicateTicket()))
+                continue
+            taken.add(key)
+            ticket = Ticket(**pending.values)
+            db.add(ticket)
+            results.append((pending, ticket))
+
+        # id талонов нужны журналу изменений — получаем их flush-ем до commit
+        db.flush()
+        if sharding_enabled:
+            # Учителя, которых перенесли в другой шард, пока пачка ждала блокировку
+            # записи (см. teacher_router.submit_ticket): пачка пишется заново без них
+            teacher_ids = {result.teacher_id for _, result in results if isinstance(result, Ticket)}
+            gone = teacher_ids - {row.id for row in db.query(User.id).filter(User.id.in_(teacher_ids))}
+            if gone:
+                db.rollback()
+                rest = [pending for pending in batch if pending.values["teacher_id"] not in gone]
+                moving = [(pending, UserMoving()) for pending in batch if pending.values["teacher_id"] in gone]
+                return moving + (self._write(db, rest) if rest else [])
+        for pending, result in results:
+            if isinstance(result, Ticket):
+                log_ticket(db, result, pending.canteen_id)
+        db.commit()
+        return results
+
+
+# Глобальный конвейер приложения (None — групповая запись выключена)
+submit_pipeline: Optional[SubmitPipeline] = None
+if SUBMIT_BATCH_MS:
+    submit_pipeline = SubmitPipeline(SessionLocal, SUBMIT_BATCH_SIZE or 64, SUBMIT_BATCH_MS)
@@ -0,0 +1,307 @@
+"""
+Кэш талонов в памяти процесса: матрица (классы × дни) для каждой столовой.
+
+Для каждой столовой хранятся массивы NumPy с количеством платных и льготных
+талонов по классам и дням текущего учебного года, а также префиксные суммы
+по дням. Благодаря этому отчёты за день, неделю или любой период считаются
+без обращения к SQLite, а итог за период — за O(1).
+
+- Включается переменной окружения TICKET_CACHE_MB (лимит памяти в мегабайтах).
+- Столовая загружается из БД при первом обращении к её отчётам.
+- При подаче талона матрица обновляется на месте (record).
+- При превышении лимита вытесняются целые столовые, давно не запрашивавшиеся (LRU).
+- В кэше только окно текущего учебного года (DAYS_WINDOW дней от его начала).
+  Архивные данные и даты за пределами окна (например, талон на 9999 год)
+  в кэш не попадают: такие запросы по-прежнему выполняются в SQL.
+
+Кэш живёт внутри одного процесса, поэтому включать его имеет смысл только
+при запуске приложения в одном воркере.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from archive import hot_boundary
+from environ_init import TICKET_CACHE_MB
+from models import Ticket, User, UserRole
+
+try:
+    import numpy as np
+except ImportError:  # numpy нужен только для кэша
+    np = None
+
+# Строки в том же виде, что и результаты SQL-запросов в canteen_router
+DayRow = namedtuple("DayRow", "class_name paid free")
+WeekRow = namedtuple("WeekRow", "d paid free")
+# Снимок талона, который добавляется в матрицу
+TicketRow = namedtuple("TicketRow", "teacher_id date class_name paid_count free_count")
+
+# Окно кэша по дням: учебный год вместе с летом и две недели запаса
+# (недельный отчёт конца августа заходит в сентябрь)
+DAYS_WINDOW = 366 + 14
+# Примерный расход памяти на один ключ талона в множестве ticket_keys
+TICKET_KEY_BYTES = 128
+
+
+class CanteenMatrix:
+    """
+    Талоны одной столовой: матрицы (классы × дни) за DAYS_WINDOW дней, начиная с даты origin.
+    - paid, free, count: значения по ячейкам (count — число талонов в ячейке,
+      чтобы отличать "подан талон на 0 человек" от "талон не подан")
+    - paid_cum, free_cum: префиксные суммы по дням для каждого класса
+      (столбец i+1 — сумма за дни 0..i)
+    - total_paid_cum, total_free_cum: те же префиксные суммы по всем классам
+    """
+
+    def __init__(self, origin: date):
+        self.origin = origin
+        self.class_names: List[str] = []
+        self.class_index = {}
+        self.sorted_rows: List[int] = []
+        # Ключи (teacher_id, date) учтённых талонов — защита от повторного учёта.
+        # Не ID: при переносе столовой в другой шард (shards.py) талоны получают новые ID
+        self.ticket_keys = set()
+        self.paid = np.zeros((0, DAYS_WINDOW), dtype=np.int32)
+        self.free = np.zeros((0, DAYS_WINDOW), dtype=np.int32)
+        self.count = np.zeros((0, DAYS_WINDOW), dtype=np.int32)
+        self.paid_cum = np.zeros((0, DAYS_WINDOW + 1), dtype=np.int64)
+        self.free_cum = np.zeros((0, DAYS_WINDOW + 1), dtype=np.int64)
+        self.total_paid_cum = np.zeros(DAYS_WINDOW + 1, dtype=np.int64)
+        self.total_free_cum = np.zeros(DAYS_WINDOW + 1, dtype=np.int64)
+
+    @property
+    def days(self) -> int:
+        return self.paid.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.paid, self.free, self.count, self.paid_cum, self.free_cum,
+                  self.total_paid_cum, self.total_free_cum)
+        return sum(a.nbytes for a in arrays) + len(self.ticket_keys) * TICKET_KEY_BYTES
+
+    def _row(self, class_name: str) -> int:
+        """Возвращает номер строки класса, при необходимости добавляя новую."""
+        row = self.class_index.get(class_name)
+        if row is not None:
+            return row
+        row = len(self.class_names)
+        self.class_names.append(class_name)
+        self.class_index[class_name] = row
+        self.sorted_rows = sorted(self.class_index.values(), key=lambda r: self.class_names[r])
+        self.paid = np.vstack([self.paid, np.zeros((1, self.days), dtype=np.int32)])
+        self.free = np.vstack([self.free, np.zeros((1, self.days), dtype=np.int32)])
+        self.count = np.vstack([self.count, np.zeros((1, self.days), dtype=np.int32)])
+        self.paid_cum = np.vstack([self.paid_cum, np.zeros((1, self.days + 1), dtype=np.int64)])
+        self.free_cum = np.vstack([self.free_cum, np.zeros((1, self.days + 1), dtype=np.int64)])
+        return row
+
+    def load(self, tickets) -> None:
+        """
+        Заполняет матрицу сразу пачкой талонов (teacher_id, date, class_name, paid, free)
+        и один раз пересчитывает префиксные суммы. Все даты должны попадать в окно.
+        """
+        tickets = list(tickets)
+        if not tickets:
+            return
+        for name in sorted({t.class_name for t in tickets}):
+            self._row(name)
+
+        rows = np.array([self.class_index[t.class_name] for t in tickets])
+        cols = np.array([(t.date - self.origin).days for t in tickets])
+        np.add.at(self.paid, (rows, cols), np.array([t.paid_count for t in tickets]))
+        np.add.at(self.free, (rows, cols), np.array([t.free_count for t in tickets]))
+        np.add.at(self.count, (rows, cols), 1)
+        self.ticket_keys.update((t.teacher_id, t.date) for t in tickets)
+
+        self.paid_cum[:, 1:] = np.cumsum(self.paid, axis=1)
+        self.free_cum[:, 1:] = np.cumsum(self.free, axis=1)
+        self.total_paid_cum = self.paid_cum.sum(axis=0)
+        self.total_free_cum = self.free_cum.sum(axis=0)
+
+    def add(self, ticket) -> None:
+        """Добавляет один талон (дата — в окне) и обновляет префиксные суммы начиная с его дня."""
+        key = (ticket.teacher_id, ticket.date)
+        if key in self.ticket_keys:
+            return
+        day = (ticket.date - self.origin).days
+        row = self._row(ticket.class_name)
+
+        self.paid[row, day] += ticket.paid_count
+        self.free[row, day] += ticket.free_count
+        self.count[row, day] += 1
+        self.paid_cum[row, day + 1:] += ticket.paid_count
+        self.free_cum[row, day + 1:] += ticket.free_count
+        self.total_paid_cum[day + 1:] += ticket.paid_count
+        self.total_free_cum[day + 1:] += ticket.free_count
+        self.ticket_keys.add(key)
+
+    def day_rows(self, dt: date) -> List[DayRow]:
+        """Строки по классам за день (только классы, подавшие талон), по алфавиту."""
+        day = (dt - self.origin).days
+        return [
+            DayRow(self.class_names[r], int(self.paid[r, day]), int(self.free[r, day]))
+            for r in self.sorted_rows if self.count[r, day] > 0
+        ]
+
+    def _range(self, cum, start: int, end: int) -> int:
+        """Сумма за дни [start, end] по префиксной сумме."""
+        if end < start:
+            return 0
+        return int(cum[end + 1] - cum[start])
+
+    def range_totals(self, start: date, end: date) -> Tuple[int, int]:
+        """Итог (платные, льготные) по всем классам за период — за O(1)."""
+        s = (start - self.origin).days
+        e = (end - self.origin).days
+        return self._range(self.total_paid_cum, s, e), self._range(self.total_free_cum, s, e)
+
+
+class PendingLoad:
+    """Идущая загрузка столовой: талоны, поданные за время загрузки, и признак сброса."""
+    __slots__ = ("tickets", "stale")
+
+    def __init__(self):
+        self.tickets: List[TicketRow] = []
+        self.stale = False
+
+
+class TicketMatrixCache:
+    """
+    Набор матриц CanteenMatrix с ограничением по памяти и вытеснением LRU.
+    Все методы потокобезопасны (FastAPI выполняет синхронные эндпоинты в пуле потоков).
+    Методы чтения возвращают None, если запрос нельзя ответить из кэша —
+    тогда вызывающий код выполняет обычный SQL-запрос.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._canteens: "OrderedDict[int, CanteenMatrix]" = OrderedDict()
+        self._loading: Dict[int, List[PendingLoad]] = {}
+        self._lock = threading.Lock()
+
+    def _matrix(self, db: Session, canteen_id: int) -> CanteenMatrix:
+        """
+        Возвращает матрицу столовой, загружая её из БД при первом обращении
+        (или если начался новый учебный год).
+        Загрузка идёт без блокировки, чтобы не задерживать record() других столовых.
+        Талоны, поданные во время загрузки, record() откладывает в PendingLoad,
+        и они добавляются в матрицу после неё (повторы отсекает ticket_keys).
+        Если во время загрузки столовую сбросили (invalidate), результат
+        отдаётся только этому запросу и в кэш не попадает.
+        """
+        origin = hot_boundary()
+        with self._lock:
+            matrix = self._canteens.get(canteen_id)
+            if matrix is not None and matrix.origin == origin:
+                self._canteens.move_to_end(canteen_id)
+                return matrix
+            pending = PendingLoad()
+            self._loading.setdefault(canteen_id, []).append(pending)
+
+        matrix = CanteenMatrix(origin)
+        try:
+            matrix.load(db.query(
+                Ticket.teacher_id, Ticket.date, Ticket.class_name, Ticket.paid_count, Ticket.free_count
+            ).join(User, User.id == Ticket.teacher_id).filter(
+                User.role == UserRole.teacher,
+                User.canteen_id == canteen_id,
+                Ticket.date >= origin,
+                Ticket.date < origin + timedelta(days=DAYS_WINDOW)
+            ).all())
+        finally:
+            with self._lock:
+                loads = [load for load in self._loading[canteen_id] if load is not pending]
+                if loads:
+                    self._loading[canteen_id] = loads
+                else:
+                    del self._loading[canteen_id]
+
+        with self._lock:
+            for ticket in pending.tickets:
+                matrix.add(ticket)
+            if pending.stale:
+                return matrix
+            # Другой запрос успел загрузить ту же столовую — используем его матрицу
+            current = self._canteens.get(canteen_id)
+            if current is not None and current.origin == origin:
+                self._canteens.move_to_end(canteen_id)
+                return current
+            self._canteens[canteen_id] = matrix
+            self._canteens.move_to_end(canteen_id)
+            self._evict()
+            return matrix
+
+    def _evict(self) -> None:
+        """Вытесняет самые старые столовые, пока кэш не уложится в лимит (последнюю оставляем всегда)."""
+        while len(self._canteens) > 1 and sum(m.nbytes for m in self._canteens.values()) > self.max_bytes:
+            self._canteens.popitem(last=False)
+
+    @staticmethod
+    def _covers(start: date, end: date) -> bool:
+        """Период [start, end] целиком в окне кэша (текущий учебный год)."""
+        origin = hot_boundary()
+        return origin <= start and (end - origin).days < DAYS_WINDOW
+
+    def day_rows(self, db: Session, canteen_id: int, dt: date) -> Optional[List[DayRow]]:
+        if not self._covers(dt, dt):
+            return None
+        matrix = self._matrix(db, canteen_id)
+        with self._lock:
+            return matrix.day_rows(dt)
+
+    def week_rows(self, db: Session, canteen_id: int, start: date, end: date) -> Optional[List[WeekRow]]:
+        if not self._covers(start, end):
+            return None
+        matrix = self._matrix(db, canteen_id)
+        with self._lock:
+            rows = []
+            d = start
+            while d <= end:
+                paid, free = matrix.range_totals(d, d)
+                rows.append(WeekRow(d, paid, free))
+                d += timedelta(days=1)
+            return rows
+
+    def range_totals(self, db: Session, canteen_id: int, start: date, end: date) -> Optional[Tuple[int, int]]:
+        if not self._covers(start, end):
+            return None
+        matrix = self._matrix(db, canteen_id)
+        with self._lock:
+            return matrix.range_totals(start, end)
+
+    def record(self, canteen_id: Optional[int], ticket: Ticket) -> None:
+        """
+        Учитывает только что сохранённый талон. Если столовая ещё не загружена —
+        ничего не делаем: талон попадёт в матрицу при загрузке
+        (а если загрузка уже идёт — будет добавлен после неё).
+        Талоны с датой за пределами окна кэша пропускаются: их отчёты считает SQL.
+        """
+        if canteen_id is None or not self._covers(ticket.date, ticket.date):
+            return
+        row = TicketRow(ticket.teacher_id, ticket.date, ticket.class_name, ticket.paid_count, ticket.free_count)
+        with self._lock:
+            matrix = self._canteens.get(canteen_id)
+            if matrix is not None and matrix.origin == hot_boundary():
+                matrix.add(row)
+                self._evict()
+            for pending in self._loading.get(canteen_id, ()):
+                pending.tickets.append(row)
+
+    def invalidate(self, *canteen_ids: Optional[int]) -> None:
+        """Сбрасывает матрицы столовых (например, когда учитель сменил столовую)."""
+        with self._lock:
+            for canteen_id in canteen_ids:
+                self._canteens.pop(canteen_id, None)
+                for pending in self._loading.get(canteen_id, ()):
+                    pending.stale = True
+
+
+# Глобальный кэш приложения (None — кэш выключен)
+ticket_cache: Optional[TicketMatrixCache] = None
+if TICKET_CACHE_MB:
+    if np is None:
+        raise ImportError("TICKET_CACHE_MB is set, but numpy is not installed")
+    ticket_cache = TicketMatrixCache(TICKET_CACHE_MB * 1024 * 1024)
@@ -0,0 +1,215 @@
+"""
+Нагрузочный тест: не замедляет ли журнал аудита (audit.py) подачу талонов.
+
+Создаёт временную SQLite-базу и папку журнала, после чего все учителя
+одновременно вызывают submit_ticket в трёх режимах (в каждом прогоне у
+каждого режима свои учителя):
+- off    — аудит выключен;
+- audit  — журнал с записью в фоне (write-behind), как в приложении;
+- inline — для сравнения: то же событие дописывается в файл прямо в запросе
+  (под общей блокировкой, с fsync по той же политике) — так выглядел бы
+  синхронный аудит.
+
+Задержка подачи в SQLite шумит сильнее, чем стоит аудит, поэтому печатается:
+1. стоимость самого вызова audit_log.record() в потоке запроса (p50/p99/max,
+   микросекунды) — именно её аудит добавляет к задержке подачи;
+2. задержки подачи (p50/p99) и пропускная способность по --trials прогонам:
+   медиана и разброс [min–max]. Порядок режимов в прогонах чередуется, чтобы
+   рост таблицы талонов не доставался одному режиму. Если медиана audit
+   попадает в разброс off, разница — шум.
+Для audit также печатается число записанных и отброшенных событий и сегментов.
+
+Запуск из корня проекта:
+    python -m tools.bench_audit --teachers 400 --threads 40 --fsync always
+    python -m tools.bench_audit --batch-ms 5 --trials 7      # подача через групповую запись
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Влияние журнала аудита на задержку подачи талонов")
+    parser.add_argument("--teachers", type=int, default=400, help="количество учителей в каждом режиме")
+    parser.add_argument("--threads", type=int, default=40,
+                        help="одновременных запросов (пул потоков FastAPI по умолчанию — 40)")
+    parser.add_argument("--fsync", choices=["always", "interval", "never"], default="always",
+                        help="политика fsync журнала")
+    parser.add_argument("--segment-kb", type=int, default=64,
+                        help="размер сегмента, КБ (маленький — чтобы проверить ротацию)")
+    parser.add_argument("--batch-ms", type=int, default=0, help="окно групповой записи талонов, мс (0 — выключена)")
+    parser.add_argument("--trials", type=int, default=5, help="количество прогонов каждого режима")
+    return parser.parse_args()
+
+
+# База и журнал создаются во временной папке — до импорта database.py, который читает DATA_ADDRESS
+args = parse_args()
+_tmp_dir = tempfile.mkdtemp(prefix="talon-bench-audit-")
+os.environ["DATA_ADDRESS"] = f"sqlite:///{os.path.join(_tmp_dir, 'bench.db')}"
+for _name in ("DATA_SHARDS", "AUDIT_DIR", "SUBMIT_BATCH_MS"):
+    os.environ[_name] = ""
+
+from fastapi import HTTPException
+
+import routers.teacher_router as teacher_router
+from audit import FSYNC_INTERVAL, AuditLog, read_events, segment_paths
+from database import Base, SessionLocal, engine
+from models import User, UserRole
+from schemas import TicketCreate
+from submit_pipeline import SubmitPipeline
+
+
+class InlineAudit:
+    """Синхронный аудит для сравнения: запись и fsync выполняются в потоке запроса."""
+
+    def __init__(self, path: str, fsync: str):
+        self.fsync = fsync
+        self._file = open(path, "ab")
+        self._lock = threading.Lock()
+        self._last_fsync = time.monotonic()
+
+    def record(self, action: str, actor_id: int, **fields) -> bool:
+        event = {"ts": datetime.now(timezone.utc).isoformat(), "action": action, "actor_id": actor_id, **fields}
+        line = (json.dumps(event, ensure_ascii=False, default=str) + "\n").encode()
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync == "always" or (
+                self.fsync == "interval" and time.monotonic() - self._last_fsync >= FSYNC_INTERVAL
+            ):
+                os.fsync(self._file.fileno())
+                self._last_fsync = time.monotonic()
+        return True
+
+
+def setup_teachers(name: str, count: int):
+    """Создаёт столовую и учителей; возвращает учителей, отсоединённых от сессии."""
+    with SessionLocal() as db:
+        canteen = User(login=f"{name}_canteen", hashed_password="-", educational_institution="bench",
+                       role=UserRole.canteen)
+        db.add(canteen)
+        db.commit()
+        db.add_all([
+            User(login=f"{name}_teacher_{i}", hashed_password="-", educational_institution="bench",
+                 role=UserRole.teacher, class_name=f"{i % 11 + 1}{'АБВГ'[i % 4]}", canteen_id=canteen.id)
+            for i in range(count)
+        ])
+        db.commit()
+        teachers = db.query(User).filter(User.canteen_id == canteen.id).all()
+        db.expunge_all()
+    return teachers
+
+
+def run_burst(teachers, threads: int):
+    """Одновременная подача талонов всеми учителями. Возвращает (задержки в секундах, время пика)."""
+    payload = TicketCreate(paid_count=20, free_count=5)   # дата по умолчанию — сегодня
+
+    def submit(teacher):
+        started = time.perf_counter()
+        with SessionLocal() as db:
+            try:
+                teacher_router.submit_ticket(payload, db, teacher)
+            except HTTPException as exc:
+                raise AssertionError(f"unexpected {exc.status_code} for {teacher.login}")
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = list(pool.map(submit, teachers))
+    return latencies, time.perf_counter() - started
+
+
+class TimedAudit:
+    """Обёртка журнала: замеряет, сколько длится вызов record() в потоке запроса."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.durations = []
+
+    def record(self, action: str, actor_id: int, **fields) -> bool:
+        started = time.perf_counter()
+        result = self.inner.record(action, actor_id, **fields)
+        self.durations.append(time.perf_counter() - started)   # list.append потокобезопасен
+        return result
+
+
+def spread(values, scale: float = 1.0) -> str:
+    """Медиана и разброс [min–max]."""
+    return (f"{statistics.median(values) * scale:7.1f} "
+            f"[{min(values) * scale:.1f}–{max(values) * scale:.1f}]")
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    modes = ("off", "audit", "inline")
+    teachers = {
+        (mode, trial): setup_teachers(f"{mode}{trial}", args.teachers)
+        for trial in range(args.trials) for mode in modes
+    }
+    print(f"database and audit log: {_tmp_dir} (fsync: {args.fsync}, trials: {args.trials}, "
+          f"batch: {f'{args.batch_ms} ms' if args.batch_ms else 'off'})")
+
+    if args.batch_ms:
+        teacher_router.submit_pipeline = SubmitPipeline(SessionLocal, 64, args.batch_ms)
+
+    p50 = {mode: [] for mode in modes}
+    p99 = {mode: [] for mode in modes}
+    rate = {mode: [] for mode in modes}
+    record_cost = {mode: [] for mode in modes}
+    written = dropped = failed = segments = 0
+    drain = []
+    for trial in range(args.trials):
+        # Порядок режимов сдвигается от прогона к прогону
+        for mode in modes[trial % 3:] + modes[:trial % 3]:
+            audit_dir = os.path.join(_tmp_dir, f"audit-{trial}")
+            audit_log = None
+            if mode == "audit":
+                audit_log = AuditLog(audit_dir, segment_bytes=args.segment_kb * 1024, fsync=args.fsync)
+                teacher_router.audit_log = TimedAudit(audit_log)
+            elif mode == "inline":
+                teacher_router.audit_log = TimedAudit(
+                    InlineAudit(os.path.join(_tmp_dir, f"inline-{trial}.log"), args.fsync))
+            else:
+                teacher_router.audit_log = None
+
+            latencies, elapsed = run_burst(teachers[mode, trial], args.threads)
+            q = statistics.quantiles(latencies, n=100)
+            p50[mode].append(q[49])
+            p99[mode].append(q[98])
+            rate[mode].append(len(latencies) / elapsed)
+            if teacher_router.audit_log:
+                record_cost[mode] += teacher_router.audit_log.durations
+
+            # close после пика дописывает очередь — проверяем, что все события дошли до файла
+            if audit_log:
+                drain_started = time.perf_counter()
+                audit_log.close()
+                drain.append(time.perf_counter() - drain_started)
+                written += sum(1 for _ in read_events(audit_dir))
+                dropped += audit_log.dropped
+                failed += audit_log.failed
+                segments += len(segment_paths(audit_dir))
+
+    print("\nrecord() in the request thread, µs:")
+    for mode in ("audit", "inline"):
+        q = statistics.quantiles(record_cost[mode], n=100)
+        print(f"  {mode:<7} calls={len(record_cost[mode]):<6} p50={q[49] * 1e6:9.1f} "
+              f"p99={q[98] * 1e6:9.1f} max={max(record_cost[mode]) * 1e6:9.1f}")
+
+    print(f"\nsubmit latency over {args.trials} trials, median [min–max]:")
+    for mode in modes:
+        print(f"  {mode:<7} p50={spread(p50[mode], 1000)} ms  p99={spread(p99[mode], 1000)} ms  "
+              f"submits/s={spread(rate[mode])}")
+
+    print(f"\naudit: events={written} of {args.teachers * args.trials} dropped={dropped} failed={failed} "
+          f"segments={segments} drain={spread(drain, 1000).strip()} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Нагрузочный тест утреннего пика подачи талонов.
+
+Создаёт временную SQLite-базу с учителями, после чего все учителя
+одновременно вызывают submit_ticket: сначала обычным путём (транзакция
+на каждый талон), затем через конвейер групповой записи (submit_pipeline.py).
+Для каждого режима печатает число commit-ов в секунду, пропускную
+способность и задержки (p50/p95/p99). Часть запросов — повторные подачи,
+они должны получить 409. На обычном пути одновременная повторная подача
+может проскочить проверку и упасть на уникальном индексе (в приложении это
+500) — такие случаи печатаются отдельно как errors.
+
+С --shards N учителя распределяются по N временным базам (shards.py):
+у каждого шарда своя столовая, а пропускная способность должна расти
+вместе с числом шардов.
+
+Запуск из корня проекта:
+    python -m tools.bench_submit --teachers 400 --threads 40 --batch-ms 5
+    python -m tools.bench_submit --shards 4
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест подачи талонов")
+    parser.add_argument("--teachers", type=int, default=400, help="количество учителей")
+    parser.add_argument("--threads", type=int, default=40,
+                        help="одновременных запросов (пул потоков FastAPI по умолчанию — 40)")
+    parser.add_argument("--batch-ms", type=int, default=5, help="окно набора пачки конвейера, мс")
+    parser.add_argument("--batch-size", type=int, default=64, help="максимальный размер пачки")
+    parser.add_argument("--duplicates", type=float, default=0.1, help="доля повторных подач")
+    parser.add_argument("--shards", type=int, default=1, help="количество шардов БД")
+    return parser.parse_args()
+
+
+# Базы создаются во временной папке — до импорта database.py, который читает DATA_ADDRESS и DATA_SHARDS
+args = parse_args()
+_tmp_dir = tempfile.mkdtemp(prefix="talon-bench-")
+_addresses = [f"sqlite:///{os.path.join(_tmp_dir, f'bench{i}.db')}" for i in range(args.shards)]
+os.environ["DATA_ADDRESS"] = _addresses[0]
+os.environ["DATA_SHARDS"] = ",".join(_addresses[1:])
+
+from fastapi import HTTPException
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+import routers.teacher_router as teacher_router
+from database import Base, SessionLocal, shard_engines
+from models import User, UserRole
+from schemas import TicketCreate
+from submit_pipeline import SubmitPipeline
+
+
+def setup_teachers(name: str, count: int):
+    """
+    Создаёт по столовой в каждом шарде и распределяет учителей между ними поровну.
+    Возвращает пары (учитель, шард); учителя отсоединены от сессии.
+    """
+    teachers = []
+    for shard, shard_engine in enumerate(shard_engines):
+        Base.metadata.create_all(bind=shard_engine)
+        with SessionLocal(bind=shard_engine) as db:
+            canteen = User(login=f"{name}_canteen", hashed_password="-", educational_institution="bench",
+                           role=UserRole.canteen)
+            db.add(canteen)
+            db.commit()
+            db.add_all([
+                User(login=f"{name}_teacher_{i}", hashed_password="-", educational_institution="bench",
+                     role=UserRole.teacher, class_name=f"{i % 11 + 1}{'АБВГ'[i % 4]}", canteen_id=canteen.id)
+                for i in range(shard, count, len(shard_engines))
+            ])
+            db.commit()
+            teachers += [(t, shard) for t in db.query(User).filter(User.canteen_id == canteen.id)]
+            db.expunge_all()
+    return teachers
+
+
+def run_burst(teachers, threads: int, duplicates: float):
+    """
+    Одновременная подача талонов всеми учителями.
+    Возвращает (задержки в секундах, число 409, число ошибок, время всего пика, число commit-ов).
+    """
+    commits = 0
+    commits_lock = threading.Lock()
+
+    def on_commit(conn):
+        nonlocal commits
+        with commits_lock:
+            commits += 1
+
+    # Повторные подачи тех же учителей — проверяем, что они получают 409
+    requests = list(teachers) + list(teachers[:int(len(teachers) * duplicates)])
+    payload = TicketCreate(paid_count=20, free_count=5)   # дата по умолчанию — сегодня
+
+    def submit(request):
+        teacher, shard = request
+        started = time.perf_counter()
+        with SessionLocal(bind=shard_engines[shard]) as db:
+            try:
+                teacher_router.submit_ticket(payload, db, teacher)
+                outcome = "ok"
+            except HTTPException as exc:
+                assert exc.status_code == 409, exc
+                outcome = "conflict"
+            except IntegrityError:
+                outcome = "error"
+        return time.perf_counter() - started, outcome
+
+    for shard_engine in shard_engines:
+        event.listen(shard_engine, "commit", on_commit)
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(submit, requests))
+        elapsed = time.perf_counter() - started
+    finally:
+        for shard_engine in shard_engines:
+            event.remove(shard_engine, "commit", on_commit)
+
+    latencies = [r[0] for r in results]
+    conflicts = sum(r[1] == "conflict" for r in results)
+    errors = sum(r[1] == "error" for r in results)
+    return latencies, conflicts, errors, elapsed, commits
+
+
+def report(name: str, latencies, conflicts: int, errors: int, elapsed: float, commits: int) -> None:
+    q = statistics.quantiles(latencies, n=100)
+    print(
+        f"{name:<10} requests={len(latencies):<5} 409={conflicts:<4} errors={errors:<4} "
+        f"time={elapsed:6.2f}s  commits={commits:<5} commits/s={commits / elapsed:8.1f}  "
+        f"submits/s={len(latencies) / elapsed:8.1f}  "
+        f"p50={q[49] * 1000:7.1f}ms p95={q[94] * 1000:7.1f}ms p99={q[98] * 1000:7.1f}ms"
+    )
+
+
+def main():
+    # У каждого режима свои учителя, чтобы оба писали в таблицу одинакового размера
+    direct_teachers = setup_teachers("direct", args.teachers)
+    pipeline_teachers = setup_teachers("pipeline", args.teachers)
+    print(f"databases: {_tmp_dir} (shards: {len(shard_engines)})")
+
+    # Обычный путь: каждый талон — своя транзакция
+    teacher_router.submit_pipeline = None
+    report("direct", *run_burst(direct_teachers, args.threads, args.duplicates))
+
+    # Групповая запись
+    teacher_router.submit_pipeline = SubmitPipeline(SessionLocal, args.batch_size, args.batch_ms)
+    report("pipeline", *run_burst(pipeline_teachers, args.threads, args.duplicates))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+Проверка кэша талонов (ticket_cache.py): отчёты столовой из кэша должны
+совпадать с отчётами, посчитанными SQL-запросами.
+
+Скрипт заполняет временную SQLite-базу случайными талонами (текущий и
+прошлый, заархивированный, учебный год) и сравнивает ответы daily_view и
+weekly_view с кэшем и без него:
+1. сразу после загрузки матриц;
+2. после подачи талонов в уже загруженный кэш (submit_ticket за сегодня
+   и record() за прошлые дни — как при групповой записи);
+   талоны на края окна кэша и на 9999-12-31 не должны раздувать матрицу;
+   талон с ID, который в матрице уже занят другим талоном (так бывает после
+   переноса столовой в другой шард), должен быть учтён;
+3. после того как учитель сменил столовую (update_me);
+4. после подачи талона, пока матрица столовой загружается: подача не должна
+   ждать загрузку, а талон — потеряться;
+5. после одновременных подач, чтений отчётов и сбросов кэша из нескольких потоков
+   (матрицы то и дело загружаются заново).
+
+Запуск из корня проекта (код возврата 1 при расхождении, удобно для CI):
+    python -m tools.cache_parity [--seed 1]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+from types import SimpleNamespace
+from datetime import date, timedelta
+
+# База создаётся во временной папке — до импорта database.py, который читает DATA_ADDRESS.
+# Кэш создаётся скриптом, групповая запись и шардирование выключены.
+_tmp_dir = tempfile.mkdtemp(prefix="talon-cache-")
+os.environ["DATA_ADDRESS"] = f"sqlite:///{os.path.join(_tmp_dir, 'cache.db')}"
+for _name in ("DATA_SHARDS", "TICKET_CACHE_MB", "SUBMIT_BATCH_MS", "AUDIT_DIR"):
+    os.environ[_name] = ""
+
+import routers.canteen_router as canteen_router
+import routers.profile_router as profile_router
+import routers.teacher_router as teacher_router
+from archive import archive_before, hot_boundary
+from database import Base, SessionLocal, engine
+from models import User, UserRole, Ticket
+from schemas import ProfileUpdate, TicketCreate
+import ticket_cache
+from ticket_cache import DAYS_WINDOW, TicketMatrixCache
+
+CANTEENS = 3
+TEACHERS = 8      # учителей на столовую
+FAR_FUTURE = date(9999, 12, 31)
+
+
+def seed(rnd: random.Random):
+    """
+    Столовые, учителя и случайные талоны с прошлого учебного года по вчерашний день
+    (прошлый год уходит в архив). Возвращает (столовые, учителя).
+    """
+    Base.metadata.create_all(bind=engine)
+    today = date.today()
+    first_day = hot_boundary() - timedelta(days=30)
+    with SessionLocal() as db:
+        canteens = [
+            User(login=f"canteen_{c}", hashed_password="-", educational_institution=f"school {c}",
+                 role=UserRole.canteen)
+            for c in range(CANTEENS)
+        ]
+        db.add_all(canteens)
+        db.flush()
+        teachers = [
+            User(login=f"teacher_{c}_{t}", hashed_password="-", educational_institution=f"school {c}",
+                 role=UserRole.teacher, class_name=f"{rnd.randint(1, 11)}{rnd.choice('АБВ')}",
+                 canteen_id=canteen.id)
+            for c, canteen in enumerate(canteens) for t in range(TEACHERS)
+        ]
+        db.add_all(teachers)
+        db.flush()
+        d = first_day
+        while d < today:
+            db.add_all([
+                Ticket(date=d, paid_count=rnd.randint(0, 30), free_count=rnd.randint(0, 5),
+                       class_name=teacher.class_name, teacher_id=teacher.id)
+                for teacher in teachers if rnd.random() < 0.7
+            ])
+            d += timedelta(days=1)
+        db.commit()
+        archive_before(db)
+        canteens = db.query(User).filter(User.role == UserRole.canteen).order_by(User.id).all()
+        teachers = db.query(User).filter(User.role == UserRole.teacher).order_by(User.id).all()
+        db.expunge_all()
+    return canteens, teachers
+
+
+def report_dates():
+    """
+    Даты дневных отчётов и начала недельных: от конца прошлого учебного года до завтра,
+    края окна кэша и неделя перед FAR_FUTURE.
+    """
+    boundary = hot_boundary()
+    days = (date.today() - boundary).days
+    edge = [boundary + timedelta(days=i) for i in range(DAYS_WINDOW - 7, DAYS_WINDOW + 1)]
+    return [boundary + timedelta(days=i) for i in range(-3, days + 2)] + edge + [FAR_FUTURE - timedelta(days=6)]
+
+
+def compare(cache: TicketMatrixCache, canteens, stage: str) -> int:
+    """Сравнивает отчёты всех столовых с кэшем и без; возвращает число расхождений."""
+    mismatches = 0
+    with SessionLocal() as db:
+        for canteen in canteens:
+            for d in report_dates():
+                for name, view in (("day", canteen_router.daily_view), ("week", canteen_router.weekly_view)):
+                    canteen_router.ticket_cache = None
+                    expected = view(d, db, canteen)
+                    canteen_router.ticket_cache = cache
+                    actual = view(d, db, canteen)
+                    if actual != expected:
+                        mismatches += 1
+                        print(f"  {stage}: {name} {d} canteen {canteen.id}\n"
+                              f"    sql:   {expected}\n    cache: {actual}")
+    canteen_router.ticket_cache = None
+    print(f"{'FAIL' if mismatches else 'ok  '} {stage}")
+    return mismatches
+
+
+def submit_today(teachers) -> None:
+    """Учителя подают талоны за сегодня через submit_ticket (с обновлением кэша)."""
+    for teacher in teachers:
+        with SessionLocal() as db:
+            teacher_router.submit_ticket(TicketCreate(paid_count=11, free_count=2), db, teacher)
+
+
+def submit_past(rnd: random.Random, cache: TicketMatrixCache, teachers, count: int) -> None:
+    """Талоны за прошлые дни текущего учебного года, записанные в обход эндпоинта, + record()."""
+    boundary = hot_boundary()
+    with SessionLocal() as db:
+        for _ in range(count):
+            teacher = rnd.choice(teachers)
+            d = boundary + timedelta(days=rnd.randrange(max((date.today() - boundary).days, 1)))
+            if db.query(Ticket.id).filter(Ticket.teacher_id == teacher.id, Ticket.date == d).first():
+                continue
+            ticket = Ticket(date=d, paid_count=rnd.randint(0, 30), free_count=rnd.randint(0, 5),
+                            class_name=teacher.class_name, teacher_id=teacher.id)
+            db.add(ticket)
+            db.commit()
+            cache.record(teacher.canteen_id, ticket)
+
+
+def submit_far(cache: TicketMatrixCache, teachers) -> bool:
+    """
+    Талоны на последний день окна кэша, первый день за окном и FAR_FUTURE (+ record()).
+    Возвращает False, если матрица столовой выросла.
+    """
+    boundary = hot_boundary()
+    dates = [boundary + timedelta(days=DAYS_WINDOW - 1), boundary + timedelta(days=DAYS_WINDOW), FAR_FUTURE]
+    canteen_id = teachers[0].canteen_id
+    with SessionLocal() as db:
+        cache.day_rows(db, canteen_id, date.today())
+        size = cache._canteens[canteen_id].nbytes
+        for teacher, d in zip(teachers, dates):
+            ticket = Ticket(date=d, paid_count=7, free_count=1, class_name=teacher.class_name,
+                            teacher_id=teacher.id)
+            db.add(ticket)
+            db.commit()
+            cache.record(teacher.canteen_id, ticket)
+    return cache._canteens[canteen_id].nbytes <= size + len(dates) * ticket_cache.TICKET_KEY_BYTES
+
+
+def submit_renumbered(cache: TicketMatrixCache, teacher: User) -> None:
+    """
+    Талон на завтра, который record() получает с ID уже учтённого талона столовой:
+    после python shards.py move талоны в новом шарде нумеруются заново.
+    """
+    with SessionLocal() as db:
+        cache.day_rows(db, teacher.canteen_id, date.today())
+        taken_id = db.query(Ticket.id).join(User, User.id == Ticket.teacher_id).filter(
+            User.canteen_id == teacher.canteen_id, Ticket.date >= hot_boundary()
+        ).first()[0]
+        ticket = Ticket(date=date.today() + timedelta(days=1), paid_count=9, free_count=2,
+                        class_name=teacher.class_name, teacher_id=teacher.id)
+        db.add(ticket)
+        db.commit()
+        cache.record(teacher.canteen_id, SimpleNamespace(
+            id=taken_id, teacher_id=ticket.teacher_id, date=ticket.date, class_name=ticket.class_name,
+            paid_count=ticket.paid_count, free_count=ticket.free_count,
+        ))
+
+
+def switch_canteen(teacher: User, canteen: User) -> User:
+    """Учитель переходит в другую столовую через update_me (кэш обеих столовых сбрасывается)."""
+    with SessionLocal() as db:
+        user = db.get(User, teacher.id)
+        user = profile_router.update_me(ProfileUpdate(canteen_id=canteen.id), db, user, db, 0)
+        db.expunge(user)
+    return user
+
+
+def submit_during_load(cache: TicketMatrixCache, teacher: User) -> bool:
+    """
+    Учитель подаёт талон из другого потока, пока матрица его столовой загружается
+    (SELECT уже выполнен, матрица ещё не в кэше). Подача не должна ждать загрузку,
+    а талон — потеряться. Возвращает False, если подача ждала загрузку дольше 5 секунд.
+    """
+    original_load = ticket_cache.CanteenMatrix.load
+    submitter = threading.Thread(target=submit_today, args=([teacher],))
+
+    def load(matrix, tickets):
+        submitter.start()
+        submitter.join(timeout=5)
+        original_load(matrix, tickets)
+
+    cache.invalidate(teacher.canteen_id)
+    ticket_cache.CanteenMatrix.load = load
+    try:
+        with SessionLocal() as db:
+            cache.day_rows(db, teacher.canteen_id, date.today())
+    finally:
+        ticket_cache.CanteenMatrix.load = original_load
+    waited = submitter.is_alive()
+    submitter.join()
+    return not waited
+
+
+def concurrent_burst(rnd: random.Random, cache: TicketMatrixCache, canteens, teachers) -> None:
+    """
+    Одновременно: учителя подают талоны за сегодня, столовые читают отчёты,
+    кэш столовых сбрасывается — матрицы то и дело загружаются заново.
+    """
+    stop = threading.Event()
+
+    def reader(canteen):
+        with SessionLocal() as db:
+            while not stop.is_set():
+                canteen_router.daily_view(date.today(), db, canteen)
+
+    def invalidator():
+        local = random.Random(rnd.random())
+        while not stop.is_set():
+            cache.invalidate(local.choice(canteens).id)
+            stop.wait(0.002)
+
+    canteen_router.ticket_cache = cache
+    threads = [threading.Thread(target=reader, args=(c,)) for c in canteens]
+    threads.append(threading.Thread(target=invalidator))
+    for thread in threads:
+        thread.start()
+    try:
+        submitters = [threading.Thread(target=submit_today, args=(teachers[i::4],)) for i in range(4)]
+        for thread in submitters:
+            thread.start()
+        for thread in submitters:
+            thread.join()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        canteen_router.ticket_cache = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сверка кэша талонов с SQL")
+    parser.add_argument("--seed", type=int, default=1, help="зерно генератора случайных данных")
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+
+    canteens, teachers = seed(rnd)
+    cache = TicketMatrixCache(64 * 1024 * 1024)
+    teacher_router.ticket_cache = cache
+    profile_router.ticket_cache = cache
+
+    mismatches = compare(cache, canteens, "loaded from SQL")
+
+    # Первая половина учителей подаёт талоны за сегодня, плюс талоны за прошлые дни
+    half = len(teachers) // 2
+    submit_today(teachers[:half])
+    submit_past(rnd, cache, teachers, 40)
+    mismatches += compare(cache, canteens, "submits after load")
+
+    # Талоны на края окна и в далёкое будущее; столовая загружается заново с ними же
+    if not submit_far(cache, teachers):
+        print("  far-future tickets grew the canteen matrix")
+        mismatches += 1
+    mismatches += compare(cache, canteens, "tickets at and beyond the cache window")
+    cache.invalidate(teachers[0].canteen_id)
+    mismatches += compare(cache, canteens, "reloaded with tickets beyond the cache window")
+
+    # Талон с ID, совпавшим с уже учтённым (перенос столовой между шардами)
+    submit_renumbered(cache, teachers[1])
+    mismatches += compare(cache, canteens, "ticket ids renumbered by a shard move")
+
+    # Учитель первой столовой (уже подавший талоны) уходит во вторую
+    teachers[0] = switch_canteen(teachers[0], canteens[1])
+    mismatches += compare(cache, canteens, "teacher switched canteen")
+
+    # Подача талона во время загрузки матрицы столовой
+    if not submit_during_load(cache, teachers[-1]):
+        print("  submit waited for the canteen load to finish")
+        mismatches += 1
+    mismatches += compare(cache, canteens, "submit during load")
+
+    # Остальные учителя подают талоны одновременно с чтением отчётов и сбросами кэша
+    concurrent_burst(rnd, cache, canteens, teachers[half:-1])
+    mismatches += compare(cache, canteens, "concurrent submits, reads and invalidations")
+
+    if mismatches:
+        print(f"\n{mismatches} cached reports differ from SQL")
+        sys.exit(1)
+    print("\nCached reports match SQL")
+
+
+if __name__ == "__main__":
+    main()
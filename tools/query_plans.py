@@ -0,0 +1,265 @@
+"""
+Проверка планов запросов: горячие запросы не должны скатываться в полный
+просмотр таблиц, а число запросов на эндпоинт — расти.
+
+Скрипт заполняет временную SQLite-базу данными нескольких масштабов,
+вызывает эндпоинты canteen_router, teacher_router, sync_router и
+auth.get_user_by_login, перехватывает их SQL через событие SQLAlchemy
+before_cursor_execute и выполняет для каждого SELECT EXPLAIN QUERY PLAN.
+
+Ошибка, если:
+- таблица из EXPECTED_INDEXES читается без индекса (SCAN) или не тем индексом;
+- любая другая таблица просматривается целиком (SCAN);
+- эндпоинт выполнил больше запросов, чем указано в MAX_QUERIES.
+
+При осознанном изменении запросов поправьте EXPECTED_INDEXES / MAX_QUERIES.
+
+Запуск из корня проекта (код возврата 1 при регрессии, удобно для CI):
+    python -m tools.query_plans [-v]
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+from datetime import date, timedelta
+
+# База создаётся во временной папке — до импорта database.py, который читает DATA_ADDRESS.
+# Шардирование, кэш и групповая запись выключены: проверяются SQL-пути.
+_tmp_dir = tempfile.mkdtemp(prefix="talon-plans-")
+os.environ["DATA_ADDRESS"] = f"sqlite:///{os.path.join(_tmp_dir, 'plans.db')}"
+for _name in ("DATA_SHARDS", "TICKET_CACHE_MB", "SUBMIT_BATCH_MS"):
+    os.environ[_name] = ""
+
+from sqlalchemy import event, func, insert, literal, select
+
+from archive import archive_before, hot_boundary
+from auth import get_user_by_login
+from changelog import format_cursor
+from database import Base, SessionLocal, engine
+from models import User, UserRole, Ticket, ChangeLog, ChangeEntity
+from routers.canteen_router import daily_view, weekly_view
+from routers.sync_router import sync
+from routers.teacher_router import submit_ticket, get_teacher_week
+from schemas import TicketCreate
+
+# Масштабы данных: (столовых, учителей на столовую, дней с талонами)
+SCALES = [(1, 5, 10), (10, 20, 90), (40, 30, 300)]
+
+# Какими индексами должны читаться таблицы в каждом эндпоинте
+TICKETS_BY_TEACHER = {"sqlite_autoindex_tickets_1"}   # UNIQUE (teacher_id, date)
+ARCHIVE_BY_TEACHER = {"sqlite_autoindex_tickets_archive_1"}
+TEACHERS_OF_CANTEEN = {"ix_users_canteen_id"}
+BY_PRIMARY_KEY = {"INTEGER PRIMARY KEY"}
+
+EXPECTED_INDEXES = {
+    "auth.get_user_by_login": {"users": {"ix_users_login"}},
+    "canteen.daily_view": {"tickets": TICKETS_BY_TEACHER, "users": TEACHERS_OF_CANTEEN},
+    "canteen.weekly_view": {"tickets": TICKETS_BY_TEACHER, "users": TEACHERS_OF_CANTEEN},
+    "canteen.weekly_view (archive)": {
+        "tickets": TICKETS_BY_TEACHER, "tickets_archive": ARCHIVE_BY_TEACHER, "users": TEACHERS_OF_CANTEEN,
+    },
+    "teacher.submit_ticket": {"tickets": TICKETS_BY_TEACHER | BY_PRIMARY_KEY},
+    "teacher.get_teacher_week": {"tickets": TICKETS_BY_TEACHER},
+    "sync.teacher": {
+        "change_log": {"ix_change_log_teacher_cursor"},
+        "tickets": BY_PRIMARY_KEY | TICKETS_BY_TEACHER, "users": BY_PRIMARY_KEY,
+    },
+    "sync.canteen": {
+        "change_log": {"ix_change_log_canteen_cursor"},
+        "tickets": BY_PRIMARY_KEY | TICKETS_BY_TEACHER, "users": BY_PRIMARY_KEY | TEACHERS_OF_CANTEEN,
+    },
+}
+
+# Максимальное число SQL-запросов на один вызов эндпоинта
+MAX_QUERIES = {
+    "auth.get_user_by_login": 1,
+    "canteen.daily_view": 1,
+    "canteen.weekly_view": 1,
+    "canteen.weekly_view (archive)": 1,
+    "teacher.submit_ticket": 4,     # проверка дубликата, INSERT талона, INSERT в журнал, refresh
+    "teacher.get_teacher_week": 1,
+    "sync.teacher": 3,              # журнал, талоны, профили (курсор — см. sync_cursor)
+    "sync.canteen": 3,
+}
+
+# Строки плана SQLite, которые не являются чтением таблиц ("SCAN CONSTANT ROW")
+INTERNAL_SCANS = {"CONSTANT"}
+
+# "CO-ROUTINE tickets_all", "MATERIALIZE teacher_ids"
+SUBQUERY = re.compile(r"^(?:CO-ROUTINE|MATERIALIZE) (\w+)")
+
+# "SEARCH tickets USING INDEX x (...)", "SEARCH users USING COVERING INDEX x", "SCAN users"
+PLAN_ACCESS = re.compile(
+    r"^(?P<op>SCAN|SEARCH) (?P<table>\w+)"
+    r"(?: USING (?:(?:COVERING )?INDEX (?P<index>\w+)|(?P<pk>INTEGER PRIMARY KEY)))?"
+)
+
+
+class QueryRecorder:
+    """Собирает SQL, выполненный движком, через событие before_cursor_execute."""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append((statement, parameters))
+
+    def __enter__(self):
+        event.listen(engine, "before_cursor_execute", self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(engine, "before_cursor_execute", self)
+
+
+def seed(canteens: int, teachers: int, days: int):
+    """
+    Заполняет базу: столовые, учителя, талоны за days дней (часть приходится
+    на прошлый учебный год и уезжает в архив) и журнал изменений.
+    Возвращает (столовую, учителя, учителя без талонов) для вызова эндпоинтов.
+    """
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    first_day = hot_boundary() - timedelta(days=days // 3)
+    with SessionLocal() as db:
+        canteen_ids = []
+        for c in range(canteens):
+            canteen = User(login=f"canteen_{c}", hashed_password="-", educational_institution=f"school {c}",
+                           role=UserRole.canteen)
+            db.add(canteen)
+            db.flush()
+            canteen_ids.append(canteen.id)
+        db.add_all([
+            User(login=f"teacher_{c}_{t}", hashed_password="-", educational_institution=f"school {c}",
+                 role=UserRole.teacher, class_name=f"{t % 11 + 1}{'АБВГ'[t % 4]}", canteen_id=canteen_id)
+            for c, canteen_id in enumerate(canteen_ids) for t in range(teachers)
+        ])
+        db.add(User(login="teacher_new", hashed_password="-", educational_institution="school 0",
+                    role=UserRole.teacher, class_name="1А", canteen_id=canteen_ids[0]))
+        db.commit()
+        teacher_rows = db.query(User.id, User.class_name).filter(
+            User.role == UserRole.teacher, User.login != "teacher_new"
+        ).all()
+        db.execute(insert(Ticket), [
+            {"date": first_day + timedelta(days=d), "paid_count": 20, "free_count": 3,
+             "class_name": t.class_name, "teacher_id": t.id}
+            for t in teacher_rows for d in range(days)
+        ])
+        db.execute(insert(ChangeLog).from_select(
+            ["entity", "entity_id", "teacher_id", "canteen_id"],
+            select(literal(ChangeEntity.ticket.name), Ticket.id, Ticket.teacher_id, User.canteen_id)
+            .join(User, User.id == Ticket.teacher_id)
+        ))
+        db.execute(insert(ChangeLog).from_select(
+            ["entity", "entity_id", "teacher_id", "canteen_id"],
+            select(literal(ChangeEntity.profile.name), User.id, User.id, User.canteen_id)
+            .where(User.role == UserRole.teacher)
+        ))
+        db.commit()
+        archive_before(db)
+        canteen = db.query(User).filter(User.login == "canteen_0").one()
+        teacher = db.query(User).filter(User.login == "teacher_0_0").one()
+        newcomer = db.query(User).filter(User.login == "teacher_new").one()
+        db.expunge_all()
+    return canteen, teacher, newcomer
+
+
+def sync_cursor(recipient) -> str:
+    """
+    Курсор /sync перед последним талоном получателя. После него в журнале идут
+    этот талон и профили, поэтому на любом масштабе sync читает и талоны, и профили
+    (с пустым курсором на больших масштабах первая страница состоит из одних талонов).
+    """
+    with SessionLocal() as db:
+        last = db.query(func.max(ChangeLog.id)).filter(recipient, ChangeLog.entity == ChangeEntity.ticket).scalar()
+    return format_cursor(0, last - 1)
+
+
+def run_endpoints(canteen: User, teacher: User, newcomer: User):
+    """Вызывает эндпоинты и возвращает {имя: [(statement, parameters), ...]}."""
+    today = date.today()
+    # Курсоры — до подачи талона newcomer-ом, который добавит запись в журнал столовой
+    teacher_cursor = sync_cursor(ChangeLog.teacher_id == teacher.id)
+    canteen_cursor = sync_cursor(ChangeLog.canteen_id == canteen.id)
+    calls = {
+        "auth.get_user_by_login": lambda db: get_user_by_login(db, teacher.login),
+        "canteen.daily_view": lambda db: daily_view(today, db, canteen),
+        "canteen.weekly_view": lambda db: weekly_view(max(today - timedelta(days=6), hot_boundary()), db, canteen),
+        "canteen.weekly_view (archive)": lambda db: weekly_view(hot_boundary() - timedelta(days=3), db, canteen),
+        "teacher.submit_ticket": lambda db: submit_ticket(
+            TicketCreate(paid_count=1, free_count=1), db, db.merge(newcomer, load=False)),
+        "teacher.get_teacher_week": lambda db: get_teacher_week(db, teacher),
+        "sync.teacher": lambda db: sync(teacher_cursor, 500, db, teacher, 0),
+        "sync.canteen": lambda db: sync(canteen_cursor, 500, db, canteen, 0),
+    }
+    captured = {}
+    for name, call in calls.items():
+        with SessionLocal() as db, QueryRecorder() as recorder:
+            call(db)
+        captured[name] = recorder.statements
+    return captured
+
+
+def explain(statement: str, parameters):
+    """Строки EXPLAIN QUERY PLAN для запроса."""
+    with engine.connect() as conn:
+        return [row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+
+
+def check(name: str, statements, verbose: bool):
+    """Проверяет число запросов и планы SELECT-ов эндпоинта; возвращает список ошибок."""
+    errors = []
+    if len(statements) > MAX_QUERIES[name]:
+        errors.append(f"{name}: {len(statements)} queries, expected at most {MAX_QUERIES[name]}")
+
+    expected = EXPECTED_INDEXES[name]
+    for statement, parameters in statements:
+        if not statement.lstrip().upper().startswith("SELECT"):
+            continue
+        plan = explain(statement, parameters)
+        if verbose:
+            print(f"  {name}: {' '.join(statement.split())[:120]}")
+            for line in plan:
+                print(f"      {line}")
+        # Подзапросы (CO-ROUTINE / MATERIALIZE) читаются SCAN-ом по своему имени — это не таблицы
+        subqueries = {m.group(1) for m in map(SUBQUERY.match, plan) if m}
+        for line in plan:
+            access = PLAN_ACCESS.match(line)
+            if not access or access.group("table") in INTERNAL_SCANS | subqueries:
+                continue
+            table = access.group("table")
+            used = access.group("index") or access.group("pk")
+            if table not in expected:
+                # Таблица не описана для эндпоинта: полный просмотр — всегда ошибка
+                if access.group("op") == "SCAN":
+                    errors.append(f"{name}: '{line}', unexpected full scan of {table}")
+            elif access.group("op") == "SCAN" or used not in expected[table]:
+                errors.append(f"{name}: '{line}', expected {table} via {sorted(expected[table])}")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка планов горячих запросов")
+    parser.add_argument("-v", "--verbose", action="store_true", help="печатать запросы и планы")
+    args = parser.parse_args()
+
+    errors = []
+    for canteens, teachers, days in SCALES:
+        canteen, teacher, newcomer = seed(canteens, teachers, days)
+        print(f"scale: {canteens} canteens x {teachers} teachers x {days} days")
+        for name, statements in run_endpoints(canteen, teacher, newcomer).items():
+            found = check(name, statements, args.verbose)
+            print(f"  {'FAIL' if found else 'ok  '} {name} ({len(statements)} queries)")
+            errors += found
+
+    if errors:
+        print("\nQuery plan regressions:")
+        for error in errors:
+            print(f"  {error}")
+        sys.exit(1)
+    print("\nAll query plans use the expected indexes")
+
+
+if __name__ == "__main__":
+    main()